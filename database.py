@@ -2,56 +2,129 @@
 Database module for Library Management System
 Handles all database operations and connections
 """
+import os
 import sqlite3
-from typing import Optional, Dict, List
-from datetime import datetime, timedelta
-DATABASE = "library.db"
+import threading
+from contextlib import contextmanager
+from typing import Optional, Dict, Iterable, List, Sequence, Set, Tuple
+from datetime import date, datetime, timedelta
+# DB_URL may be a plain path or a sqlite "file:" URI (e.g. file::memory:?cache=shared)
+DATABASE = os.environ.get("DB_URL", "library.db")
+
+# One connection per thread, opened lazily and reused by every helper below
+_local = threading.local()
+
+# Database paths init_database() has already built the schema for
+_INITIALISED: Set[str] = set()
+
 
 def get_db_connection() -> sqlite3.Connection:
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    """
+    Return this thread's cached connection, opening it on first use.
+
+    The connection runs in autocommit mode (isolation_level=None), so single
+    statements commit on their own and multi-statement work has to BEGIN
+    explicitly.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE, isolation_level=None, check_same_thread=False,
+                               uri=DATABASE.startswith("file:"))
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")
+        conn.row_factory = sqlite3.Row
+        # SQLite's own lower()/LIKE only fold ASCII; searches use this for full Unicode
+        conn.create_function("casefold", 1, str.casefold, deterministic=True)
+        _local.conn = conn
     return conn
 
+
+def close_db_connection() -> None:
+    """Close and forget this thread's cached connection (next call reopens it)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+class _Rollback(Exception):
+    """Raised inside _transaction() to undo the block on purpose; args[0] says why."""
+
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection):
+    """
+    Group the statements in the with-block into one transaction. The
+    connection is in autocommit mode, so a plain `with conn:` would not.
+
+    If a transaction is already open (e.g. the caller's), the block runs in a
+    SAVEPOINT instead, so a failure only undoes the block itself.
+    """
+    if conn.in_transaction:
+        conn.execute("SAVEPOINT block")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK TO block")
+            conn.execute("RELEASE block")
+            raise
+        conn.execute("RELEASE block")
+        return
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
 def init_database() -> None:
-    """Initialize the database with required tables."""
+    """Initialize the database with required tables (once per database path)."""
+    if DATABASE in _INITIALISED:
+        return
     conn = get_db_connection()
-    try:
-        # books table
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS books (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                author TEXT NOT NULL,
-                isbn TEXT UNIQUE NOT NULL,
-                total_copies INTEGER NOT NULL,
-                available_copies INTEGER NOT NULL
-            )
-            """
-        )
-        # borrow_records table
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS borrow_records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patron_id TEXT NOT NULL,
-                book_id INTEGER NOT NULL,
-                borrow_date TEXT NOT NULL,
-                due_date TEXT NOT NULL,
-                return_date TEXT,
-                FOREIGN KEY (book_id) REFERENCES books (id)
-            )
-            """
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    conn.executescript(
+        """
+        -- books table
+        CREATE TABLE IF NOT EXISTS books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            isbn TEXT UNIQUE NOT NULL,
+            total_copies INTEGER NOT NULL,
+            available_copies INTEGER NOT NULL
+        );
+
+        -- borrow_records table
+        CREATE TABLE IF NOT EXISTS borrow_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patron_id TEXT NOT NULL,
+            book_id INTEGER NOT NULL,
+            borrow_date TEXT NOT NULL,
+            due_date TEXT NOT NULL,
+            return_date TEXT,
+            FOREIGN KEY (book_id) REFERENCES books (id)
+        );
+
+        -- borrow_records lookups: active loans per patron (+book) and history by date
+        CREATE INDEX IF NOT EXISTS idx_br_patron_active
+        ON borrow_records (patron_id) WHERE return_date IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_br_patron_book_active
+        ON borrow_records (patron_id, book_id) WHERE return_date IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_br_patron_borrow_date
+        ON borrow_records (patron_id, borrow_date DESC);
+        """
+    )
+    _INITIALISED.add(DATABASE)
 
 
 def add_sample_data() -> None:
     """Add sample data to the database if it's empty."""
     conn = get_db_connection()
-    try:
+    with _transaction(conn):
         book_count = conn.execute("SELECT COUNT(*) AS count FROM books").fetchone()["count"]
         if book_count == 0:
             sample_books = [
@@ -59,14 +132,13 @@ def add_sample_data() -> None:
                 ("To Kill a Mockingbird", "Harper Lee", "9780061120084", 2),
                 ("1984", "George Orwell", "9780451524935", 1),
             ]
-            for title, author, isbn, copies in sample_books:
-                conn.execute(
-                    """
-                    INSERT INTO books (title, author, isbn, total_copies, available_copies)
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    (title, author, isbn, copies, copies),
-                )
+            conn.executemany(
+                """
+                INSERT INTO books (title, author, isbn, total_copies, available_copies)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                [(title, author, isbn, copies, copies) for title, author, isbn, copies in sample_books],
+            )
 
             # Make 1984 unavailable by adding a borrow record
             conn.execute(
@@ -84,77 +156,88 @@ def add_sample_data() -> None:
 
             # Update available copies for 1984
             conn.execute("UPDATE books SET available_copies = 0 WHERE id = 3")
-            conn.commit()
-    finally:
-        conn.close()
 
-def get_all_books() -> List[Dict]:
-    """Get all books from the database."""
+def get_all_books() -> List[sqlite3.Row]:
+    """Get all books from the database (rows support row["title"] like a dict)."""
     conn = get_db_connection()
-    try:
-        rows = conn.execute("SELECT * FROM books ORDER BY title").fetchall()
-        return [dict(r) for r in rows]
-    finally:
-        conn.close()
+    return conn.execute(
+        "SELECT id, title, author, isbn, total_copies, available_copies FROM books ORDER BY title"
+    ).fetchall()
 
 
 def get_book_by_id(book_id: int) -> Optional[Dict]:
     """Get a specific book by ID."""
     conn = get_db_connection()
-    try:
-        row = conn.execute("SELECT * FROM books WHERE id = ?", (book_id,)).fetchone()
-        return dict(row) if row else None
-    finally:
-        conn.close()
+    row = conn.execute("SELECT * FROM books WHERE id = ?", (book_id,)).fetchone()
+    return dict(row) if row else None
 
 
 def get_book_by_isbn(isbn: str) -> Optional[Dict]:
     """Get a specific book by ISBN."""
     conn = get_db_connection()
-    try:
-        row = conn.execute("SELECT * FROM books WHERE isbn = ?", (isbn,)).fetchone()
-        return dict(row) if row else None
-    finally:
-        conn.close()
+    row = conn.execute("SELECT * FROM books WHERE isbn = ?", (isbn,)).fetchone()
+    return dict(row) if row else None
+
+
+def get_available_copies(book_id: int) -> Optional[int]:
+    """Current available_copies for one book (None if it doesn't exist); always read fresh."""
+    conn = get_db_connection()
+    row = conn.execute("SELECT available_copies FROM books WHERE id = ?", (book_id,)).fetchone()
+    return row[0] if row else None
+
+
+# Columns search_books_by_field may filter on (interpolated into SQL, so whitelist only)
+_SEARCH_FIELDS = {"title", "author"}
+
+
+def search_books_by_field(field: str, needle: str) -> List[sqlite3.Row]:
+    """
+    Case-insensitive (Unicode casefold) substring match on title or author, ordered by title.
+    The needle is matched literally, so % and _ are just characters. Any other field
+    returns an empty list.
+    """
+    if field not in _SEARCH_FIELDS:
+        return []
+    conn = get_db_connection()
+    return conn.execute(
+        f"""
+        SELECT id, title, author, isbn, total_copies, available_copies
+        FROM books WHERE instr(casefold({field}), ?) > 0 ORDER BY title
+        """,
+        (needle.casefold(),),
+    ).fetchall()
 
 #######
-def get_active_borrow(patron_id: str, book_id: int) -> Optional[Dict]:
+def get_active_borrow(patron_id: str, book_id: int) -> Optional[sqlite3.Row]:
     """
     Return the active borrow row (no return_date) for this patron+book, or None.
-    Columns returned: patron_id, book_id, borrow_date, due_date
+    Columns returned: patron_id, book_id, borrow_date, due_date (read as row["due_date"])
     """
     conn = get_db_connection()
-    try:
-        cur = conn.execute(
-            """
-            SELECT patron_id, book_id, borrow_date, due_date
-            FROM borrow_records
-            WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
-            ORDER BY borrow_date DESC
-            LIMIT 1
-            """,
-            (patron_id, book_id),
-        )
-        row = cur.fetchone()
-        if not row:
-            return None
-        cols = [c[0] for c in cur.description]
-        return dict(zip(cols, row))
-    finally:
-        conn.close()
+    return conn.execute(
+        """
+        SELECT patron_id, book_id, borrow_date, due_date
+        FROM borrow_records
+        WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+        ORDER BY borrow_date DESC
+        LIMIT 1
+        """,
+        (patron_id, book_id),
+    ).fetchone()
 
 
-def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
-    """Get currently borrowed books for a patron."""
+def get_patron_borrowed_books(patron_id: str, now: Optional[datetime] = None) -> List[Dict]:
+    """Get currently borrowed books for a patron; is_overdue is judged against now (default: the clock)."""
+    now = now or datetime.now()
     conn = get_db_connection()
     records = conn.execute('''
-        SELECT br.*, b.title, b.author 
+        SELECT br.*, b.title, b.author,
+               date(br.due_date) < date(?) AS is_overdue
         FROM borrow_records br 
         JOIN books b ON br.book_id = b.id 
         WHERE br.patron_id = ? AND br.return_date IS NULL
         ORDER BY br.borrow_date
-    ''', (patron_id,)).fetchall()
-    conn.close()
+    ''', (now.isoformat(), patron_id)).fetchall()
 
     borrowed_books = []
     for record in records:
@@ -164,7 +247,7 @@ def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
             'author': record['author'],
             'borrow_date': datetime.fromisoformat(record['borrow_date']),
             'due_date': datetime.fromisoformat(record['due_date']),
-            'is_overdue': datetime.now() > datetime.fromisoformat(record['due_date'])
+            'is_overdue': bool(record['is_overdue'])
         })
 
     return borrowed_books
@@ -177,9 +260,22 @@ def get_patron_borrow_count(patron_id: str) -> int:
         SELECT COUNT(*) as count FROM borrow_records 
         WHERE patron_id = ? AND return_date IS NULL
     ''', (patron_id,)).fetchone()['count']
-    conn.close()
     return count
 
+
+def patron_at_limit(patron_id: str, limit: int = 5) -> bool:
+    """True if the patron has at least limit active loans; stops reading rows at limit."""
+    conn = get_db_connection()
+    rows = conn.execute(
+        """
+        SELECT 1 FROM borrow_records
+        WHERE patron_id = ? AND return_date IS NULL
+        LIMIT ?
+        """,
+        (patron_id, limit),
+    ).fetchall()
+    return len(rows) >= limit
+
 def insert_book(title: str, author: str, isbn: str, total_copies: int, available_copies: int) -> bool:
     """Insert a new book into the database."""
     conn = get_db_connection()
@@ -188,12 +284,80 @@ def insert_book(title: str, author: str, isbn: str, total_copies: int, available
             INSERT INTO books (title, author, isbn, total_copies, available_copies)
             VALUES (?, ?, ?, ?, ?)
         ''', (title, author, isbn, total_copies, available_copies))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        conn.close()
+    except sqlite3.Error:
+        return False
+    return True
+
+
+# INSERT ... RETURNING needs sqlite 3.35+; older builds fall back to lastrowid
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def insert_book_returning_id(title: str, author: str, isbn: str,
+                             total_copies: int, available_copies: int) -> Optional[int]:
+    """Insert a new book and hand back its id in the same round-trip (None on error)."""
+    conn = get_db_connection()
+    sql = '''
+        INSERT INTO books (title, author, isbn, total_copies, available_copies)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+    params = (title, author, isbn, total_copies, available_copies)
+    try:
+        if _HAS_RETURNING:
+            book_id = conn.execute(sql + " RETURNING id", params).fetchone()[0]
+        else:
+            book_id = conn.execute(sql, params).lastrowid
+    except sqlite3.Error:
+        return None
+    return book_id
+
+
+def bulk_insert_books(rows: Iterable[Tuple[str, str, str, int, int]]) -> bool:
+    """
+    Insert many books in one transaction with a single prepared statement.
+    rows are (title, author, isbn, total_copies, available_copies); all or nothing.
+    """
+    conn = get_db_connection()
+    try:
+        with _transaction(conn):
+            conn.executemany('''
+                INSERT INTO books (title, author, isbn, total_copies, available_copies)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+    except sqlite3.Error:
+        return False
+    return True
+
+
+def get_book_ids_by_isbn(isbns: Sequence[str]) -> Dict[str, int]:
+    """Map each ISBN that exists in the catalog to its book id, in one query."""
+    if not isbns:
+        return {}
+    conn = get_db_connection()
+    placeholders = ", ".join("?" * len(isbns))
+    rows = conn.execute(
+        f"SELECT id, isbn FROM books WHERE isbn IN ({placeholders})", tuple(isbns)
+    ).fetchall()
+    return {r["isbn"]: r["id"] for r in rows}
+
+
+def insert_book_if_new(title: str, author: str, isbn: str, total_copies: int, available_copies: int) -> Optional[bool]:
+    """
+    Insert a book unless its ISBN is already in the catalog, in one statement.
+    Returns True when inserted, False for a duplicate ISBN, None on a database error.
+    """
+    conn = get_db_connection()
+    try:
+        cur = conn.execute('''
+            INSERT INTO books (title, author, isbn, total_copies, available_copies)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (isbn) DO NOTHING
+        ''', (title, author, isbn, total_copies, available_copies))
+    except sqlite3.Error:
+        return None
+    if cur.rowcount != 1:
         return False
+    return True
 
 
 def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime) -> bool:
@@ -209,12 +373,30 @@ def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, du
             """,
             (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()),
         )
-        conn.commit()
         return True
     except sqlite3.Error:
         return False
-    finally:
-        conn.close()
+
+
+def bulk_insert_borrow_records(rows: Iterable[Tuple[str, int, datetime, datetime]]) -> bool:
+    """
+    Insert many borrow records in one transaction with a single prepared statement.
+    rows are (patron_id, book_id, borrow_date, due_date); all or nothing.
+    """
+    conn = get_db_connection()
+    try:
+        with _transaction(conn):
+            conn.executemany(
+                """
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+                VALUES (?, ?, ?, ?)
+                """,
+                ((patron_id, book_id, borrow_date.isoformat(), due_date.isoformat())
+                 for patron_id, book_id, borrow_date, due_date in rows),
+            )
+    except sqlite3.Error:
+        return False
+    return True
 
 
 def update_book_availability(book_id: int, change: int) -> bool:
@@ -224,12 +406,25 @@ def update_book_availability(book_id: int, change: int) -> bool:
         conn.execute('''
             UPDATE books SET available_copies = available_copies + ? WHERE id = ?
         ''', (change, book_id))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        conn.close()
+    except sqlite3.Error:
         return False
+    return True
+
+
+def update_availability_bulk(pairs: Iterable[Tuple[int, int]]) -> bool:
+    """
+    Apply many (book_id, change) stock adjustments in one transaction with a single
+    prepared statement; all or nothing.
+    """
+    conn = get_db_connection()
+    try:
+        with _transaction(conn):
+            conn.executemany('''
+                UPDATE books SET available_copies = available_copies + ? WHERE id = ?
+            ''', [(change, book_id) for book_id, change in pairs])
+    except sqlite3.Error:
+        return False
+    return True
 
 
 def update_borrow_record_return_date(patron_id: str, book_id: int, return_date: datetime) -> bool:
@@ -246,46 +441,175 @@ def update_borrow_record_return_date(patron_id: str, book_id: int, return_date:
             """,
             (return_date.isoformat(), patron_id, book_id),
         )
-        conn.commit()
         return True
     except sqlite3.Error:
         return False
-    finally:
-        conn.close()
+
+def get_patron_loans(patron_id: str, now: Optional[datetime] = None) -> List[sqlite3.Row]:
+    """
+    Return every borrow for a patron, newest first, in one query.
+    Dates stay as the stored ISO strings; is_overdue (active loans whose due day is
+    before today, so a loan due today isn't overdue yet) is worked out by SQLite,
+    so nothing needs parsing on the way out.
+    """
+    now = now or datetime.now()
+    conn = get_db_connection()
+    return conn.execute(
+        """
+        SELECT br.book_id, b.title, b.author,
+               br.borrow_date, br.due_date, br.return_date,
+               br.return_date IS NULL AND date(br.due_date) < date(?) AS is_overdue
+        FROM borrow_records br
+        JOIN books b ON br.book_id = b.id
+        WHERE br.patron_id = ?
+        ORDER BY br.borrow_date DESC
+        """,
+        (now.isoformat(), patron_id),
+    ).fetchall()
+
 
 def get_patron_borrow_history(patron_id: str) -> List[Dict]:
     """
     Return every borrow for a patron with the most recent coming first (includes both active and returned).
+    Same rows as get_patron_loans with the dates parsed into datetimes.
+    """
+    rows = get_patron_loans(patron_id)
+
+    out: List[Dict] = []
+    for r in rows:
+        bd = datetime.fromisoformat(r["borrow_date"]) if r["borrow_date"] else None
+        dd = datetime.fromisoformat(r["due_date"]) if r["due_date"] else None
+        rd = datetime.fromisoformat(r["return_date"]) if r["return_date"] else None
+        out.append(
+            {
+                "book_id": r["book_id"],
+                "title": r["title"],
+                "author": r["author"],
+                "borrow_date": bd,
+                "due_date": dd,
+                "return_date": rd,
+            }
+        )
+    return out
+
+
+def borrow_book_atomic(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime,
+                       max_loans: int = 5) -> str:
+    """
+    Take one copy off the shelf and record the loan in a single transaction.
+
+    The stock decrement is a conditional UPDATE, so two concurrent borrows can't
+    both get the last copy. Returns "ok", "unavailable" (no copies left),
+    "limit" (patron already has max_loans active) or "error".
     """
     conn = get_db_connection()
     try:
-        rows = conn.execute(
-            """
-            SELECT br.book_id, b.title, b.author,
-                   br.borrow_date, br.due_date, br.return_date
+        with _transaction(conn):
+            cur = conn.execute(
+                """
+                UPDATE books SET available_copies = available_copies - 1
+                WHERE id = ? AND available_copies > 0
+                """,
+                (book_id,),
+            )
+            if cur.rowcount != 1:
+                raise _Rollback("unavailable")
+
+            if patron_at_limit(patron_id, max_loans):
+                raise _Rollback("limit")
+
+            conn.execute(
+                """
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+                VALUES (?, ?, ?, ?)
+                """,
+                (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()),
+            )
+    except _Rollback as stop:
+        return stop.args[0]
+    except sqlite3.Error:
+        return "error"
+    return "ok"
+
+
+def return_book_atomic(patron_id: str, book_id: int, return_date: datetime) -> bool:
+    """
+    Close the patron's latest active loan for this book and put the copy back
+    on the shelf in a single transaction. False (and nothing written) if there
+    is no active loan or either statement fails.
+    """
+    conn = get_db_connection()
+    try:
+        with _transaction(conn):
+            cur = conn.execute(
+                """
+                UPDATE borrow_records
+                SET return_date = ?
+                WHERE id = (
+                    SELECT id FROM borrow_records
+                    WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+                    ORDER BY borrow_date DESC
+                    LIMIT 1
+                )
+                """,
+                (return_date.isoformat(), patron_id, book_id),
+            )
+            if cur.rowcount != 1:
+                raise _Rollback("no active loan")
+
+            conn.execute(
+                "UPDATE books SET available_copies = available_copies + 1 WHERE id = ?",
+                (book_id,),
+            )
+    except (_Rollback, sqlite3.Error):
+        return False
+    return True
+
+
+# Active loans for a patron with their tiered late fee, priced inside SQLite in
+# integer cents: 50c/day for the first 7 overdue days, then 100c/day, max 1500c.
+# fee is the same amount in dollars.
+# Days are whole calendar days between the due date and the given "today".
+# Parameters: today, patron_id, book_id, book_id (book_id None means every book).
+_ACTIVE_LOAN_FEES_SQL = """
+    SELECT book_id, title, borrow_date, days_late, fee_cents, fee_cents / 100.0 AS fee
+    FROM (
+        SELECT book_id, title, borrow_date, days_late,
+               MIN(1500, MIN(days_late, 7) * 50 + MAX(days_late - 7, 0) * 100) AS fee_cents
+        FROM (
+            SELECT br.book_id, b.title, br.borrow_date,
+                   -- an unparseable due_date gives NULL; count it as not late rather than NULL fees
+                   COALESCE(MAX(0, CAST(julianday(?) - julianday(date(br.due_date)) AS INTEGER)), 0) AS days_late
             FROM borrow_records br
             JOIN books b ON br.book_id = b.id
-            WHERE br.patron_id = ?
-            ORDER BY br.borrow_date DESC
-            """,
-            (patron_id,),
-        ).fetchall()
-
-        out: List[Dict] = []
-        for r in rows:
-            bd = datetime.fromisoformat(r["borrow_date"]) if r["borrow_date"] else None
-            dd = datetime.fromisoformat(r["due_date"]) if r["due_date"] else None
-            rd = datetime.fromisoformat(r["return_date"]) if r["return_date"] else None
-            out.append(
-                {
-                    "book_id": r["book_id"],
-                    "title": r["title"],
-                    "author": r["author"],
-                    "borrow_date": bd,
-                    "due_date": dd,
-                    "return_date": rd,
-                }
-            )
-        return out
-    finally:
-        conn.close()
+            WHERE br.patron_id = ? AND br.return_date IS NULL
+              AND (? IS NULL OR br.book_id = ?)
+        )
+    )
+"""
+
+
+def get_patron_fee_summary(patron_id: str, today: date, book_id: Optional[int] = None) -> List[sqlite3.Row]:
+    """
+    Return (book_id, title, days_late, fee_cents, fee) for each of the patron's active loans,
+    newest loan first. Pass book_id to only get the loans for that book.
+    """
+    conn = get_db_connection()
+    return conn.execute(
+        f"{_ACTIVE_LOAN_FEES_SQL} ORDER BY borrow_date DESC",
+        (today.isoformat(), patron_id, book_id, book_id),
+    ).fetchall()
+
+
+def get_patron_late_fee_cents(patron_id: str, today: date) -> int:
+    """Return the patron's total late fees in cents across all active loans (loans not yet late are skipped)."""
+    conn = get_db_connection()
+    return conn.execute(
+        f"SELECT COALESCE(SUM(fee_cents), 0) FROM ({_ACTIVE_LOAN_FEES_SQL}) WHERE days_late > 0",
+        (today.isoformat(), patron_id, None, None),
+    ).fetchone()[0]
+
+
+def get_patron_late_fee_total(patron_id: str, today: date) -> float:
+    """Return the patron's total late fees in dollars across all active loans."""
+    return get_patron_late_fee_cents(patron_id, today) / 100
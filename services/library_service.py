@@ -2,21 +2,31 @@
 Library Service Module - Business Logic Functions
 Contains all the core business logic for the Library Management System
 """
+import re
 from services.payment_service import PaymentGateway
-from datetime import datetime, timedelta
-from typing import Dict, List, Tuple
-from typing import Dict, List, Optional, Tuple
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
 from database import (
-    get_book_by_id, get_book_by_isbn, get_patron_borrow_count,
-    insert_book, insert_borrow_record, update_book_availability,
-    update_borrow_record_return_date, get_active_borrow, get_all_books,
-    get_patron_borrowed_books,
-    get_patron_borrow_history,
+    get_book_by_id, get_book_by_isbn,
+    insert_book_if_new, borrow_book_atomic, return_book_atomic,
+    get_active_borrow, search_books_by_field,
+    get_patron_loans, get_patron_late_fee_cents, get_patron_fee_summary,
 )
 
 # Late fee policy $0.50 per overdue day
 LATE_FEE_CENTS = 50
 
+# Most books a patron can have out at once
+MAX_ACTIVE_LOANS = 5
+
+# Compiled once; \A...\Z so a trailing newline doesn't sneak past like it would with $,
+# and [0-9] rather than \d, which also matches non-ASCII digits like "١٢٣"
+_PATRON_RE = re.compile(r"\A[0-9]{6}\Z")
+_ISBN_RE = re.compile(r"\A[0-9]{13}\Z")
+
+# Where "now" comes from for due dates and late fees; tests swap in a fixed clock
+CLOCK: Callable[[], datetime] = datetime.now
+
 
 def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
     """
@@ -32,35 +42,35 @@ def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -
         Returns:
             tuple: (success: bool, message: str)
     """
-    if not title or not title.strip():
+    # strip once and reuse
+    title = title.strip() if title else ""
+    author = author.strip() if author else ""
+
+    if not title:
         return False, "Title is required."
 
-    if len(title.strip()) > 200:
+    if len(title) > 200:
         return False, "Title must be less than 200 characters."
 
-    if not author or not author.strip():
+    if not author:
         return False, "Author is required."
 
-    if len(author.strip()) > 100:
+    if len(author) > 100:
         return False, "Author must be less than 100 characters."
 
-    if len(isbn) != 13:
+    if not (isbn and _ISBN_RE.match(isbn)):
         return False, "ISBN must be exactly 13 digits."
 
     if not isinstance(total_copies, int) or total_copies <= 0:
         return False, "Total copies must be a positive integer."
 
-    # Check for duplicate ISBN
-    existing = get_book_by_isbn(isbn)
-    if existing:
+    # Insert new book; the UNIQUE isbn constraint catches duplicates in the same statement
+    inserted = insert_book_if_new(title, author, isbn, total_copies, total_copies)
+    if inserted:
+        return True, f'Book "{title}" has been successfully added to the catalog.'
+    if inserted is False:
         return False, "A book with this ISBN already exists."
-
-    # Insert new book
-    success = insert_book(title.strip(), author.strip(), isbn, total_copies, total_copies)
-    if success:
-        return True, f'Book "{title.strip()}" has been successfully added to the catalog.'
-    else:
-        return False, "Database error occurred while adding the book."
+    return False, "Database error occurred while adding the book."
 
 def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     """
@@ -75,29 +85,26 @@ def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
         tuple: (success: bool, message: str)
     """
     # Validate patron ID
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+    if not (patron_id and _PATRON_RE.match(patron_id)):
         return False, "Invalid patron ID. Must be exactly 6 digits."
 
-    # Check if book exists and is available
+    # Check if book exists
     book = get_book_by_id(book_id)
     if not book:
         return False, "Book not found."
 
-    if book["available_copies"] <= 0:
-        return False, "This book is currently not available."
-
-    if get_patron_borrow_count(patron_id) >= 5:
-        return False, "You have reached the maximum borrowing limit of 5 books."
-
-    borrow_date = datetime.now()
+    borrow_date = CLOCK()
     due_date = borrow_date + timedelta(days=14)
 
-    if not insert_borrow_record(patron_id, book_id, borrow_date, due_date):
+    # stock and loan-limit checks happen inside the same transaction as the insert
+    status = borrow_book_atomic(patron_id, book_id, borrow_date, due_date, MAX_ACTIVE_LOANS)
+    if status == "unavailable":
+        return False, "This book is currently not available."
+    if status == "limit":
+        return False, f"You have reached the maximum borrowing limit of {MAX_ACTIVE_LOANS} books."
+    if status != "ok":
         return False, "Database error occurred while creating borrow record."
 
-    if not update_book_availability(book_id, -1):
-        return False, "Database error occurred while updating book availability."
-
     return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'
 
 def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
@@ -113,7 +120,7 @@ def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
         Tuple[bool, str]: (ok, message). ok=True when return is saved and stock is updated.
     """
     # patron id must be six digits
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+    if not (patron_id and _PATRON_RE.match(patron_id)):
         return False, "Invalid patron ID (need 6 digits)."
 
     # the book has to exist
@@ -128,28 +135,60 @@ def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
 
     # late fee if we're past the due date
     try:
-        due_dt = datetime.fromisoformat(loan["due_date"])
+        due_day = _iso_to_ordinal(loan["due_date"])
     except Exception:
 
         # if we can't read the date treat it as no fee
-        due_dt = None
+        due_day = None
 
-    now = datetime.now()
+    now = CLOCK()
     fee_cents = 0
-    if due_dt is not None and now.date() > due_dt.date():
-        days_over = (now.date() - due_dt.date()).days
-        fee_cents = days_over * LATE_FEE_CENTS
+    if due_day is not None and now.toordinal() > due_day:
+        fee_cents = (now.toordinal() - due_day) * LATE_FEE_CENTS
 
-    # write the return and bump stock
-    if not update_borrow_record_return_date(patron_id, book_id, now):
+    # write the return and bump stock in one transaction
+    if not return_book_atomic(patron_id, book_id, now):
         return False, "Couldn't record the return in the database."
-    if not update_book_availability(book_id, +1):
-        return False, "Couldn't update book availability."
 
     if fee_cents > 0:
         return True, f"Return complete. Late fee: ${fee_cents/100:.2f}."
     return True, "Return complete. No fee."
 
+def _today_ordinal() -> int:
+    """Today as a day number (date.toordinal), so date math is int subtraction."""
+    return CLOCK().toordinal()
+
+
+def _iso_to_ordinal(value: str) -> int:
+    """Day number of a stored ISO timestamp, read from its YYYY-MM-DD prefix."""
+    return date(int(value[0:4]), int(value[5:7]), int(value[8:10])).toordinal()
+
+
+def _tiered_late_fee(days_late: int) -> float:
+    """
+    Tiered late fee for a loan days_late days past due.
+    $0.50/day for the first 7 overdue days, then $1/day, max $15.00.
+    """
+    if days_late <= 0:
+        return 0.0
+    first_block = min(days_late, 7)
+    later_block = max(0, days_late - 7)
+    raw = first_block * 0.50 + later_block * 1.00
+    return round(min(raw, 15.00), 2)
+
+
+# Fee for each day count up to where the $15 cap kicks in (day 19), worked out once;
+# the last entry is the cap, so anything later reuses it
+_FEE_TABLE = tuple(_tiered_late_fee(d) for d in range(20))
+
+
+def _late_fee(days_late: int) -> float:
+    """Tiered late fee for a loan days_late days past due, read from _FEE_TABLE."""
+    if days_late <= 0:
+        return 0.0
+    return _FEE_TABLE[min(days_late, len(_FEE_TABLE) - 1)]
+
+
 def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
     """
     Computes the current late fee for one active loan.
@@ -168,7 +207,7 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
         Max $15.00 per book
     """
     # quick guards
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+    if not (patron_id and _PATRON_RE.match(patron_id)):
         return {"fee_amount": 0.00, "days_overdue": 0, "status": "Invalid patron ID"}
     book = get_book_by_id(book_id)
     if not book:
@@ -181,23 +220,15 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
 
     # days overdue
     try:
-        due_dt = datetime.fromisoformat(loan["due_date"])
+        days_late = _today_ordinal() - _iso_to_ordinal(loan["due_date"])
     except Exception:
         return {"fee_amount": 0.00, "days_overdue": 0, "status": "Invalid due date"}
 
-    today = datetime.now().date()
-    days_late = (today - due_dt.date()).days
     if days_late <= 0:
         return {"fee_amount": 0.00, "days_overdue": 0, "status": "on time"}
 
-    # pricing for first 7 days at $0.50/day and then $1/day. cap stands at $15
-    first_block = min(days_late, 7)
-    later_block = max(0, days_late - 7)
-    raw = first_block * 0.50 + later_block * 1.00
-    fee = min(raw, 15.00)
-
     return {
-        "fee_amount": round(fee, 2),
+        "fee_amount": _late_fee(days_late),
         "days_overdue": int(days_late),
         "status": "overdue",
     }
@@ -220,19 +251,24 @@ def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
 
     # ISBN must match exactly and be 13 digits
     if field == "isbn":
-        if len(query) != 13 or not query.isdigit():
+        if not _ISBN_RE.match(query):
             return []
         hit = get_book_by_isbn(query)
         return [hit] if hit else []
 
-    # Title/author partial and case insensitive match over the whole shelf
-    shelf = get_all_books()
-    needle = query.casefold()
-    if field == "title":
-        return [row for row in shelf if needle in (row.get("title") or "").casefold()]
-    if field == "author":
-        return [row for row in shelf if needle in (row.get("author") or "").casefold()]
-    return []
+    # Title/author partial and case insensitive match, filtered by SQLite
+    return [dict(row) for row in search_books_by_field(field, query)]
+
+
+def _empty_report(status: str) -> Dict:
+    """A status report with no loans, no history and no fees (fresh lists every call)."""
+    return {
+        "borrowed_now": [],
+        "active_count": 0,
+        "late_fees": "0.00",
+        "history": [],
+        "status": status,
+    }
 
 
 def get_patron_status_report(patron_id: str) -> Dict:
@@ -251,71 +287,55 @@ def get_patron_status_report(patron_id: str) -> Dict:
         }
     """
     pid = (patron_id or "").strip()
-    if not (pid.isdigit() and len(pid) == 6):
-        return {
-            "borrowed_now": [],
-            "active_count": 0,
-            "late_fees": "0.00",
-            "history": [],
-            "status": "Invalid patron ID",
-        }
+    if not _PATRON_RE.match(pid):
+        # malformed ids never reach the database
+        return _empty_report("Invalid patron ID")
+
+    # All borrows newest first, active and returned, in one query
+    now = CLOCK()
+    hist_rows = get_patron_loans(pid, now)
+
+    # Late fees for every active loan, summed in one SQL aggregate
+    fee_cents = get_patron_late_fee_cents(pid, now.date())
 
-    # Active loans
-    active_rows = get_patron_borrowed_books(pid)
+    # Active loans oldest first; dates stay as the stored ISO strings
     borrowed_now: List[Dict] = []
-    fee_total = 0.0
-    for row in active_rows:
-        book_id = row["book_id"]
-        fee_info = calculate_late_fee_for_book(pid, book_id)
-        try:
-            fee_total += float(fee_info.get("fee_amount", 0.0) or 0.0)
-        except (TypeError, ValueError):
-
-            # ignores odd values
-            pass
-
-        # keeps dates readable
-        due_dt = row.get("due_date")
-        due_iso = due_dt.date().isoformat() if hasattr(due_dt, "date") else (str(due_dt) if due_dt else None)
+    for row in reversed(hist_rows):
+        if row["return_date"] is not None:
+            continue
         borrowed_now.append(
             {
-                "book_id": book_id,
-                "title": row.get("title"),
-                "author": row.get("author"),
-                "due_date": due_iso,
-                "overdue": bool(row.get("is_overdue")),
+                "book_id": row["book_id"],
+                "title": row["title"],
+                "author": row["author"],
+                "due_date": row["due_date"][:10],
+                "overdue": bool(row["is_overdue"]),
             }
         )
 
-    # All borrows newest first
-    hist_rows = get_patron_borrow_history(pid)
     history: List[Dict] = []
-    def _to_iso(val):
-        if val is None:
-            return None
-        return val.isoformat() if hasattr(val, "isoformat") else str(val)
     for r in hist_rows:
         history.append(
             {
                 "book_id": r["book_id"],
                 "title": r["title"],
                 "author": r["author"],
-                "borrow_date": _to_iso(r.get("borrow_date")),
-                "due_date": _to_iso(r.get("due_date")),
-                "return_date": _to_iso(r.get("return_date")),
+                "borrow_date": r["borrow_date"],
+                "due_date": r["due_date"],
+                "return_date": r["return_date"],
             }
         )
     return {
         "borrowed_now": borrowed_now,
         "active_count": len(borrowed_now),
-        "late_fees": f"{fee_total:.2f}",
+        "late_fees": f"{fee_cents // 100}.{fee_cents % 100:02d}",
         "history": history,
         "status": "ok",
     }
 
 
 
-def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway = None) -> Tuple[bool, str, Optional[str]]:
+def pay_late_fees(patron_id: str, book_id: int, payment_gateway: Optional[PaymentGateway] = None) -> Tuple[bool, str, Optional[str]]:
     """
     Process payment for late fees using external payment gateway.
     
@@ -337,37 +357,61 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
         success, msg, txn = pay_late_fees("123456", 1, mock_gateway)
     """
     # Validate patron ID
-    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+    if not (patron_id and _PATRON_RE.match(patron_id)):
         return False, "Invalid patron ID. Must be exactly 6 digits.", None
     
-    # Calculate late fee first
-    fee_info = calculate_late_fee_for_book(patron_id, book_id)
+    # One query gives both the fee and the title for the description
+    loans = get_patron_fee_summary(patron_id, CLOCK().date(), book_id)
     
-    # Check if there's a fee to pay
-    if not fee_info or 'fee_amount' not in fee_info:
-        return False, "Unable to calculate late fees.", None
+    # Check if there's a fee to pay (no active loan means no fee either)
+    if not loans or loans[0]["fee"] <= 0:
+        return False, "No late fees to pay for this book.", None
     
-    fee_amount = fee_info.get('fee_amount', 0.0)
+    # Use provided gateway or create new one
+    if payment_gateway is None:
+        payment_gateway = PaymentGateway()
     
-    if fee_amount <= 0:
-        return False, "No late fees to pay for this book.", None
+    return _charge_late_fee(patron_id, loans[0], payment_gateway)
+
+
+def pay_all_late_fees(patron_id: str, payment_gateway: Optional[PaymentGateway] = None) -> List[Tuple[int, bool, Optional[str]]]:
+    """
+    Pay the late fees on every overdue active loan a patron has, one gateway charge per book.
     
-    # Get book details for payment description
-    book = get_book_by_id(book_id)
-    if not book:
-        return False, "Book not found.", None
+    Args:
+        patron_id: 6-digit library card ID
+        payment_gateway: Payment gateway instance (injectable for testing)
+        
+    Returns:
+        list: (book_id, success, transaction_id) per book with a fee; empty for an invalid patron ID
+    """
+    if not (patron_id and _PATRON_RE.match(patron_id)):
+        return []
+    
+    # Fees and titles for every active loan in one query
+    loans = [row for row in get_patron_fee_summary(patron_id, CLOCK().date()) if row["fee"] > 0]
+    if not loans:
+        return []
     
-    # Use provided gateway or create new one
     if payment_gateway is None:
         payment_gateway = PaymentGateway()
     
+    results: List[Tuple[int, bool, Optional[str]]] = []
+    for loan in loans:
+        success, _, transaction_id = _charge_late_fee(patron_id, loan, payment_gateway)
+        results.append((loan["book_id"], success, transaction_id))
+    return results
+
+
+def _charge_late_fee(patron_id: str, loan, payment_gateway: PaymentGateway) -> Tuple[bool, str, Optional[str]]:
+    """Charge one loan's fee (a get_patron_fee_summary row) through the gateway."""
     # Process payment through external gateway
     # THIS IS WHAT YOU SHOULD MOCK IN THEIR TESTS!
     try:
         success, transaction_id, message = payment_gateway.process_payment(
             patron_id=patron_id,
-            amount=fee_amount,
-            description=f"Late fees for '{book['title']}'"
+            amount=round(loan["fee"], 2),
+            description=f"Late fees for '{loan['title']}'"
         )
         
         if success:
@@ -380,7 +424,7 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
         return False, f"Payment processing error: {str(e)}", None
 
 
-def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: PaymentGateway = None) -> Tuple[bool, str]:
+def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: Optional[PaymentGateway] = None) -> Tuple[bool, str]:
     """
     Refund a late fee payment (e.g., if book was returned on time but fees were charged in error).
     
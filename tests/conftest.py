@@ -1,3 +1,4 @@
+import os
 import sys
 from pathlib import Path
 import pytest
@@ -7,20 +8,78 @@ ROOT = Path(__file__).resolve().parent.parent
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
+# Tests never need durability: keep the whole DB in memory.
+# Has to be set before database is imported, it reads DB_URL at import time.
+# Each pytest-xdist worker gets its own named in-memory DB (gw0 when not under xdist).
+_WORKER_ID = os.environ.get("PYTEST_XDIST_WORKER", "gw0")
+TEST_DB_URL = f"file:memdb_{_WORKER_ID}?mode=memory&cache=shared"
+os.environ["DB_URL"] = TEST_DB_URL
+
 # imported after fixing sys.path
 import database
+from services import library_service
 
-@pytest.fixture(autouse=True)
-def sandbox_db(tmp_path, monkeypatch):
+@pytest.fixture(scope="session")
+def db_schema():
     """
-    For every test point the app at a throwaway sqlite file and build the tables.
+    Open the in-memory DB once for the whole run and build the tables.
+    The connection stays open until the end; the DB disappears with it.
     """
-    db_file = tmp_path / "sqlite_test.db"
-    monkeypatch.setattr(database, "DATABASE", str(db_file), raising=False)
+    database.close_db_connection()
+    database._INITIALISED.clear()
+    conn = database.get_db_connection()
+    conn.executescript(
+        "PRAGMA journal_mode=MEMORY; PRAGMA synchronous=OFF;"
+        " PRAGMA temp_store=MEMORY; PRAGMA locking_mode=EXCLUSIVE;"
+    )
     database.init_database()
+    yield
+    database.close_db_connection()
+
+
+@pytest.fixture(autouse=True)
+def sandbox_db(db_schema, request):
+    """
+    For every test empty the tables instead of rebuilding them.
+    Tests marked fresh_db get the tables dropped and recreated from scratch;
+    tests marked preserve_catalog keep the rows a module-scoped fixture seeded.
+    """
+    conn = database.get_db_connection()
+    if request.node.get_closest_marker("fresh_db"):
+        conn.executescript("DROP TABLE IF EXISTS borrow_records; DROP TABLE IF EXISTS books;")
+        database._INITIALISED.discard(database.DATABASE)
+        database.init_database()
+    elif not request.node.get_closest_marker("preserve_catalog"):
+        conn.executescript("DELETE FROM borrow_records; DELETE FROM books;")
+
+    # sanity check to check tests are using the in-memory DB
+    assert database.DATABASE == TEST_DB_URL
+    yield
 
-    # sanity check to check tests are using the temp DB
-    assert str(database.DATABASE).endswith("sqlite_test.db")
 
-    # tmp_path is cleaned by pytest
+@pytest.fixture(autouse=True)
+def db_transaction(sandbox_db, request):
+    """
+    Run each test's DB writes inside one transaction and roll it back at the end,
+    so the dozens of small inserts a test makes don't each commit on their own.
+    The code under test shares this thread's connection, so it sees its own writes.
+    Tests marked no_transaction run in autocommit mode; the next wipe cleans up after them.
+    """
+    conn = database.get_db_connection()
+    if not conn.in_transaction and not request.node.get_closest_marker("no_transaction"):
+        conn.execute("BEGIN")
     yield
+    if conn.in_transaction:
+        conn.rollback()
+
+
+@pytest.fixture(autouse=True)
+def frozen_clock(request, monkeypatch):
+    """
+    Tests marked frozen_clock(moment) get library_service's clock pinned to moment,
+    so the dates they seed and the code under test agree on what "now" is.
+    """
+    marker = request.node.get_closest_marker("frozen_clock")
+    if marker is not None:
+        moment = marker.args[0]
+        monkeypatch.setattr(library_service, "CLOCK", lambda: moment)
@@ -1,27 +1,40 @@
-from unittest.mock import Mock
+import pytest
+from unittest.mock import ANY, Mock
 from datetime import datetime, timedelta
+from services import library_service
 from services.payment_service import PaymentGateway
-from services.library_service import pay_late_fees, refund_late_fee_payment, add_book_to_catalog, return_book_by_patron
+from services.library_service import (
+    pay_late_fees, pay_all_late_fees, refund_late_fee_payment,
+    add_book_to_catalog, return_book_by_patron,
+)
+from database import (
+    get_db_connection, insert_book, insert_borrow_record,
+    get_available_copies, get_book_by_isbn, get_active_borrow,
+)
+
+# Spec'ing against the class walks dir(PaymentGateway) on every Mock; do it once
+_GATEWAY_SPEC = [name for name in dir(PaymentGateway) if not name.startswith("_")]
+
+
+@pytest.fixture
+def gateway_double():
+    """A PaymentGateway stand-in; tests set the return values they need."""
+    return Mock(spec=_GATEWAY_SPEC)
 
 # pay_late_fees required tests
 
-def test_successful_payment(mocker):
+def test_successful_payment(mocker, gateway_double):
     # Test successful payment
-    def fake_fee_calc(patron_id, book_id):
+    def fake_fee_lookup(patron_id, today, book_id):
 
         # stub for this scenario
         assert patron_id == "121212"
         assert book_id == 99
-        return {"fee_amount": 15, "days_overdue": 20, "status": "ok"}
-    fee_calc_stub = mocker.patch(
-        "services.library_service.calculate_late_fee_for_book",
-        side_effect=fake_fee_calc,
+        return [{"book_id": 99, "title": "The tests", "days_late": 20, "fee": 15}]
+    fee_lookup_stub = mocker.patch.object(
+        library_service, "get_patron_fee_summary",
+        side_effect=fake_fee_lookup,
     )
-    book_lookup_stub = mocker.patch(
-        "services.library_service.get_book_by_id",
-        return_value={"title": "The tests"},
-    )
-    gateway_double = Mock(spec=PaymentGateway)
     gateway_double.process_payment.return_value = (True, "OX_422", "All good")
     ok, msg, tx_id = pay_late_fees("121212", 99, payment_gateway=gateway_double)
 
@@ -30,11 +43,9 @@ def test_successful_payment(mocker):
     assert tx_id == "OX_422"
     assert msg == "Payment successful! All good"
 
-    # Checks the stubs and mock were used as expected
-    fee_calc_stub.assert_called_once()
-    fee_calc_stub.assert_called_with("121212", 99)
-    book_lookup_stub.assert_called_once()
-    book_lookup_stub.assert_called_with(99)
+    # Checks the stub and mock were used as expected
+    fee_lookup_stub.assert_called_once()
+    fee_lookup_stub.assert_called_with("121212", ANY, 99)
     gateway_double.process_payment.assert_called_once()
     gateway_double.process_payment.assert_called_with(
         patron_id="121212",
@@ -42,17 +53,12 @@ def test_successful_payment(mocker):
         description="Late fees for 'The tests'",
     )
 
-def test_payment_declined_by_gateway(mocker):
+def test_payment_declined_by_gateway(mocker, gateway_double):
     # Test payment declined by gateway
-    fee_calc_stub = mocker.patch(
-        "services.library_service.calculate_late_fee_for_book",
-        return_value={"fee_amount": 5.00, "days_overdue": 2, "status": "ok"},
-    )
-    book_lookup_stub = mocker.patch(
-        "services.library_service.get_book_by_id",
-        return_value={"title": "Can't charge me"},
+    fee_lookup_stub = mocker.patch.object(
+        library_service, "get_patron_fee_summary",
+        return_value=[{"book_id": 7, "title": "Can't charge me", "days_late": 2, "fee": 5.00}],
     )
-    gateway_double = Mock(spec=PaymentGateway)
     gateway_double.process_payment.return_value = (False, None, "Card declined")
     ok, msg, tx_id = pay_late_fees("778899", 7, payment_gateway=gateway_double)
 
@@ -60,10 +66,8 @@ def test_payment_declined_by_gateway(mocker):
     assert ok is False
     assert tx_id is None
     assert msg == "Payment failed: Card declined"
-    fee_calc_stub.assert_called_once()
-    fee_calc_stub.assert_called_with("778899", 7)
-    book_lookup_stub.assert_called_once()
-    book_lookup_stub.assert_called_with(7)
+    fee_lookup_stub.assert_called_once()
+    fee_lookup_stub.assert_called_with("778899", ANY, 7)
     gateway_double.process_payment.assert_called_once()
     gateway_double.process_payment.assert_called_with(
         patron_id="778899",
@@ -71,67 +75,56 @@ def test_payment_declined_by_gateway(mocker):
         description="Late fees for 'Can't charge me'",
     )
 
-def test_invalid_patron_id_verify_mock_not_called(mocker):
+def test_invalid_patron_id_verify_mock_not_called(mocker, gateway_double):
     # Test invalid patron ID (verifies mock NOT called)
-    fee_calc_stub = mocker.patch(
-        "services.library_service.calculate_late_fee_for_book"
-    )
-    book_lookup_stub = mocker.patch(
-        "services.library_service.get_book_by_id"
+    fee_lookup_stub = mocker.patch.object(
+        library_service, "get_patron_fee_summary"
     )
-    gateway_double = Mock(spec=PaymentGateway)
     ok, msg, tx_id = pay_late_fees("55!?55", 99, payment_gateway=gateway_double)
 
     # Sanity check
     assert ok is False
     assert tx_id is None
     assert msg == "Invalid patron ID. Must be exactly 6 digits."
-    fee_calc_stub.assert_not_called()
-    book_lookup_stub.assert_not_called()
+    fee_lookup_stub.assert_not_called()
     gateway_double.process_payment.assert_not_called()
 
 
-def test_zero_late_fees_verify_mock_not_called(mocker):
-    active_borrow_stub = mocker.patch(
-        "services.library_service.get_active_borrow",
-        return_value={
-            "book_id": 777,
-            "patron_id": "549821",
-            "due_date": (datetime.now() + timedelta(days=3)).isoformat(),
-        },
-    )
-    fee_calc_stub = mocker.patch(
-        "services.library_service.calculate_late_fee_for_book",
-        return_value={"fee_amount": 0.0, "days_overdue": 0, "status": "ok"},
+def test_zero_late_fees_verify_mock_not_called(mocker, gateway_double):
+    fee_lookup_stub = mocker.patch.object(
+        library_service, "get_patron_fee_summary",
+        return_value=[{"book_id": 777, "title": "On Time", "days_late": 0, "fee": 0.0}],
     )
-    book_lookup_stub = mocker.patch(
-        "services.library_service.get_book_by_id"
-    )
-    gateway_double = Mock(spec=PaymentGateway)
     ok, msg, tx_id = pay_late_fees("549821", 777, payment_gateway=gateway_double)
 
     # Sanity checks on result and interactions
     assert ok is False
     assert tx_id is None
     assert msg == "No late fees to pay for this book."
-    fee_calc_stub.assert_called_once()
-    fee_calc_stub.assert_called_with("549821", 777)
-    book_lookup_stub.assert_not_called()
+    fee_lookup_stub.assert_called_once()
+    fee_lookup_stub.assert_called_with("549821", ANY, 777)
     gateway_double.process_payment.assert_not_called()
-    active_borrow_stub.assert_not_called()
 
 
-def test_network_error_exception_handling(mocker):
-    # Test network error exception handling.
-    fee_calc_stub = mocker.patch(
-        "services.library_service.calculate_late_fee_for_book",
-        return_value={"fee_amount": 6.5, "days_overdue": 2, "status": "ok"},
+def test_no_active_loan_verify_mock_not_called(mocker, gateway_double):
+    # No active loan for that book means no fee row at all
+    mocker.patch.object(
+        library_service, "get_patron_fee_summary",
+        return_value=[],
     )
-    book_lookup_stub = mocker.patch(
-        "services.library_service.get_book_by_id",
-        return_value={"title": "CISC327 Book"},
+    ok, msg, tx_id = pay_late_fees("549821", 778, payment_gateway=gateway_double)
+    assert ok is False
+    assert tx_id is None
+    assert msg == "No late fees to pay for this book."
+    gateway_double.process_payment.assert_not_called()
+
+
+def test_network_error_exception_handling(mocker, gateway_double):
+    # Test network error exception handling.
+    fee_lookup_stub = mocker.patch.object(
+        library_service, "get_patron_fee_summary",
+        return_value=[{"book_id": 65, "title": "CISC327 Book", "days_late": 2, "fee": 6.5}],
     )
-    gateway_double = Mock(spec=PaymentGateway)
     gateway_double.process_payment.side_effect = Exception("Gateway timeout")
 
     ok, msg, tx_id = pay_late_fees("000000", 65, payment_gateway=gateway_double)
@@ -139,8 +132,7 @@ def test_network_error_exception_handling(mocker):
     assert tx_id is None
     assert msg.startswith("Payment processing error: ")
     assert "Gateway timeout" in msg
-    fee_calc_stub.assert_called_with("000000", 65)
-    book_lookup_stub.assert_called_with(65)
+    fee_lookup_stub.assert_called_with("000000", ANY, 65)
     gateway_double.process_payment.assert_called_once()
     gateway_double.process_payment.assert_called_with(
         patron_id="000000",
@@ -148,11 +140,74 @@ def test_network_error_exception_handling(mocker):
         description="Late fees for 'CISC327 Book'",
     )
 
+# pay_all_late_fees tests
+
+def test_pay_all_charges_each_overdue_book(mocker, gateway_double):
+    # Two overdue books and one on time, only the overdue ones get charged, one gateway call each
+    mocker.patch.object(
+        library_service, "get_patron_fee_summary",
+        return_value=[
+            {"book_id": 1, "title": "First", "days_late": 3, "fee": 1.5},
+            {"book_id": 2, "title": "Second", "days_late": 0, "fee": 0.0},
+            {"book_id": 3, "title": "Third", "days_late": 10, "fee": 6.5},
+        ],
+    )
+    gateway_double.process_payment.side_effect = [
+        (True, "txn_a", "ok"),
+        (False, None, "Card declined"),
+    ]
+    results = pay_all_late_fees("313131", payment_gateway=gateway_double)
+    assert results == [(1, True, "txn_a"), (3, False, None)]
+    assert gateway_double.process_payment.call_count == 2
+    gateway_double.process_payment.assert_called_with(
+        patron_id="313131",
+        amount=6.5,
+        description="Late fees for 'Third'",
+    )
+
+
+def test_pay_all_invalid_patron_skips_everything(mocker, gateway_double):
+    fee_lookup_stub = mocker.patch.object(library_service, "get_patron_fee_summary")
+    assert pay_all_late_fees("12ab56", payment_gateway=gateway_double) == []
+    fee_lookup_stub.assert_not_called()
+    gateway_double.process_payment.assert_not_called()
+
+
+def test_pay_late_fees_against_real_db(gateway_double):
+    # No stubs on the DB side, a loan 3 days overdue is charged $1.50 with the book title
+    insert_book("Overdue Orchard", "P. Picker", "9600000010010", 1, 0)
+    book = get_book_by_isbn("9600000010010")["id"]
+    due = datetime.now() - timedelta(days=3)
+    insert_borrow_record("232323", book, due - timedelta(days=14), due)
+    gateway_double.process_payment.return_value = (True, "txn_9", "Paid")
+    ok, msg, tx_id = pay_late_fees("232323", book, payment_gateway=gateway_double)
+    assert ok is True
+    assert tx_id == "txn_9"
+    gateway_double.process_payment.assert_called_once_with(
+        patron_id="232323",
+        amount=1.5,
+        description="Late fees for 'Overdue Orchard'",
+    )
+
+
+def test_unparseable_due_date_counts_as_no_fee(gateway_double):
+    # A due_date SQLite can't read must not turn the fee into None and blow up the comparison
+    insert_book("Smudged Slip", "I. Llegible", "9600000020020", 1, 0)
+    book = get_book_by_isbn("9600000020020")["id"]
+    get_db_connection().execute(
+        "INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date) VALUES (?, ?, ?, ?)",
+        ("242424", book, datetime.now().isoformat(), "garbage"),
+    )
+    assert pay_late_fees("242424", book, payment_gateway=gateway_double) == (
+        False, "No late fees to pay for this book.", None,
+    )
+    assert pay_all_late_fees("242424", payment_gateway=gateway_double) == []
+    gateway_double.process_payment.assert_not_called()
+
 # refund_late_fee_payment required tests
 
-def test_successful_refund(mocker):
+def test_successful_refund(mocker, gateway_double):
     # Test successful refund
-    gateway_double = mocker.Mock(spec=PaymentGateway)
     gateway_double.refund_payment.return_value = (True, "Reversal accepted")
     ok, msg = refund_late_fee_payment("txn_1", 9.75, payment_gateway=gateway_double)
     assert ok is True
@@ -160,9 +215,8 @@ def test_successful_refund(mocker):
     gateway_double.refund_payment.assert_called_once()
     gateway_double.refund_payment.assert_called_with("txn_1", 9.75)
 
-def test_invalid_transaction_id_rejection(mocker):
+def test_invalid_transaction_id_rejection(mocker, gateway_double):
     # Test invalid transaction id rejection
-    gateway_double = mocker.Mock(spec=PaymentGateway)
     ok, msg = refund_late_fee_payment(
         "receipt_404", 4.20, payment_gateway=gateway_double
     )
@@ -173,7 +227,8 @@ def test_invalid_transaction_id_rejection(mocker):
 
 def test_invalid_refund_amount_negative():
     # Test invalid refund amounts- negative
-    gateway_double = Mock(spec=PaymentGateway)
+    # rejected before the gateway is touched, so a bare Mock is enough
+    gateway_double = Mock()
     ok, msg = refund_late_fee_payment(
         "txn_2", -3.15, payment_gateway=gateway_double
     )
@@ -184,7 +239,7 @@ def test_invalid_refund_amount_negative():
 
 def test_invalid_refund_amount_zero():
     # Test invalid refund amounts- zero
-    gateway_double = Mock(spec=PaymentGateway)
+    gateway_double = Mock()
 
     ok, msg = refund_late_fee_payment(
         "txn_3", 0.0, payment_gateway=gateway_double
@@ -196,7 +251,7 @@ def test_invalid_refund_amount_zero():
 
 def test_invalid_refund_amount_exceeds_15_maximum():
     # Test invalid refund amounts (exceeds $15 maximum)
-    gateway_double = Mock(spec=PaymentGateway)
+    gateway_double = Mock()
     ok, msg = refund_late_fee_payment(
         "txn_4", 19.25, payment_gateway=gateway_double
     )
@@ -207,13 +262,12 @@ def test_invalid_refund_amount_exceeds_15_maximum():
 
 # Additional tests to reach 80%+ coverage
 
-def test_refund_uses_default_payment_gateway_when_none(mocker):
+def test_refund_uses_default_payment_gateway_when_none(mocker, gateway_double):
     # If no gateway is passed in the function should construct PaymentGateway() and use it.
     # Arranges stub out PaymentGateway() so we don't hit the real class
-    gateway_double = Mock(spec=PaymentGateway)
     gateway_double.refund_payment.return_value = (True, "Reversal is accepted")
-    gateway_cls_stub = mocker.patch(
-        "services.library_service.PaymentGateway",
+    gateway_cls_stub = mocker.patch.object(
+        library_service, "PaymentGateway",
         return_value=gateway_double,
     )
 
@@ -229,9 +283,8 @@ def test_refund_uses_default_payment_gateway_when_none(mocker):
     gateway_double.refund_payment.assert_called_with("txn_50", 5.00)
 
 
-def test_refund_gateway_returns_false():
+def test_refund_gateway_returns_false(gateway_double):
     # Gateway returns (False, message) and the helper should give 'Refund failed'
-    gateway_double = Mock(spec=PaymentGateway)
     gateway_double.refund_payment.return_value = (False, "Card expired")
     ok, msg = refund_late_fee_payment(
         "txn_110", 7.00, payment_gateway=gateway_double
@@ -244,10 +297,9 @@ def test_refund_gateway_returns_false():
     gateway_double.refund_payment.assert_called_with("txn_110", 7.00)
 
 
-def test_refund_gateway_exception_wrapped():
+def test_refund_gateway_exception_wrapped(gateway_double):
     # Any exception from the gateway should be linked to a Refund processing error message
     # simulate a noisy third-party gateway raising exception
-    gateway_double = Mock(spec=PaymentGateway)
     gateway_double.refund_payment.side_effect = Exception("Gateway offline")
     ok, msg = refund_late_fee_payment(
         "txn_765", 5.00, payment_gateway=gateway_double
@@ -300,11 +352,11 @@ def test_author_over_100_chars():
 
 def test_book_missing_book(mocker):
     # get_book_by_id() returns None 'Book not found' branch
-    book_lookup_stub = mocker.patch(
-        "services.library_service.get_book_by_id",
+    book_lookup_stub = mocker.patch.object(
+        library_service, "get_book_by_id",
         return_value=None,
     )
-    loan_stub = mocker.patch("services.library_service.get_active_borrow")
+    loan_stub = mocker.patch.object(library_service, "get_active_borrow")
     ok, msg = return_book_by_patron("909191", 444)
     assert ok is False
     assert msg == "Book not found."
@@ -315,12 +367,12 @@ def test_book_missing_book(mocker):
 
 def test_no_active_loan_patron(mocker):
     # Book exists but get_active_borrow() returns None
-    mocker.patch(
-        "services.library_service.get_book_by_id",
+    mocker.patch.object(
+        library_service, "get_book_by_id",
         return_value={"id": 444, "title": "Ghost Loan"},
     )
-    active_stub = mocker.patch(
-        "services.library_service.get_active_borrow",
+    active_stub = mocker.patch.object(
+        library_service, "get_active_borrow",
         return_value=None,
     )
     ok, msg = return_book_by_patron("828282", 444)
@@ -330,56 +382,45 @@ def test_no_active_loan_patron(mocker):
     active_stub.assert_called_with("828282", 444)
 
 def test_fails_when_record_update_fails(mocker):
-    # update_borrow_record_return_date() returns false first DB error branch.
-    mocker.patch(
-        "services.library_service.get_book_by_id",
+    # return_book_atomic() returns false so the DB error branch is hit.
+    mocker.patch.object(
+        library_service, "get_book_by_id",
         return_value={"id": 333, "title": "Return Glitch"},
     )
     past_due = (datetime.now() - timedelta(days=2)).isoformat()
-    mocker.patch(
-        "services.library_service.get_active_borrow",
+    mocker.patch.object(
+        library_service, "get_active_borrow",
         return_value={"due_date": past_due},
     )
-    record_stub = mocker.patch(
-        "services.library_service.update_borrow_record_return_date",
+    return_stub = mocker.patch.object(
+        library_service, "return_book_atomic",
         return_value=False,
     )
-    stock_stub = mocker.patch(
-        "services.library_service.update_book_availability",
-        return_value=True,
-    )
     ok, msg = return_book_by_patron("414141", 333)
     assert ok is False
     assert msg == "Couldn't record the return in the database."
-    record_stub.assert_called_once()
-    called_patron, called_book, _ = record_stub.call_args[0]
+    return_stub.assert_called_once()
+    called_patron, called_book, _ = return_stub.call_args[0]
     assert called_patron == "414141"
     assert called_book == 333
-    stock_stub.assert_not_called()
 
 
-def test_stock_update_fails(mocker):
-    # Record update succeeds but stock update fails which should trigger second db error branch.
-    mocker.patch(
-        "services.library_service.get_book_by_id",
-        return_value={"id": 909, "title": "Inventory Trouble"},
-    )
-    ok_due = (datetime.now() - timedelta(days=1)).isoformat()
-    mocker.patch(
-        "services.library_service.get_active_borrow",
-        return_value={"due_date": ok_due},
+def test_stock_update_fails_rolls_back_return():
+    # Stock update blows up after the return date is written, the whole return must roll back.
+    insert_book("Inventory Trouble", "S. Keeper", "9600000009009", 1, 0)
+    book = get_book_by_isbn("9600000009009")["id"]
+    now = datetime.now()
+    insert_borrow_record("565656", book, now - timedelta(days=3), now + timedelta(days=11))
+    get_db_connection().execute(
+        """
+        CREATE TEMP TRIGGER block_stock BEFORE UPDATE ON books
+        BEGIN SELECT RAISE(ABORT, 'stock locked'); END
+        """
     )
-    record_stub = mocker.patch(
-        "services.library_service.update_borrow_record_return_date",
-        return_value=True,
-    )
-    stock_stub = mocker.patch(
-        "services.library_service.update_book_availability",
-        return_value=False,
-    )
-    ok, msg = return_book_by_patron("565656", 909)
+    ok, msg = return_book_by_patron("565656", book)
     assert ok is False
-    assert msg == "Couldn't update book availability."
-    record_stub.assert_called_once()
-    stock_stub.assert_called_once()
-    stock_stub.assert_called_with(909, +1)
+    assert msg == "Couldn't record the return in the database."
+
+    # loan is still open and stock untouched
+    assert get_active_borrow("565656", book) is not None
+    assert get_available_copies(book) == 0
@@ -1,5 +1,8 @@
+import sqlite3
+import threading
+import database
 from services.library_service import add_book_to_catalog
-from database import get_book_by_isbn
+from database import get_book_by_isbn, get_book_by_id
 
 def test_valid_insert():
     """
@@ -61,6 +64,28 @@ def test_isbn_length_13():
     assert get_book_by_isbn(isbn_too_long) is None
 
 
+def test_isbn_digits_only():
+    """
+    negative, a 13 character ISBN with letters in it is still rejected and nothing is stored.
+    """
+    isbn_lettered = "978014143951X"
+    ok, note = add_book_to_catalog("Emma", "Jane Austen", isbn_lettered, 1)
+    assert ok is False
+    assert "13" in note
+    assert get_book_by_isbn(isbn_lettered) is None
+
+
+def test_isbn_ascii_digits_only():
+    """
+    negative, 13 Arabic-Indic digits are digits to Unicode but not an ISBN; rejected, nothing stored.
+    """
+    isbn_arabic = "٩٧٨٠١٤١٤٣٩٥٨٧"
+    ok, note = add_book_to_catalog("Emma", "Jane Austen", isbn_arabic, 1)
+    assert ok is False
+    assert "13" in note
+    assert get_book_by_isbn(isbn_arabic) is None
+
+
 def test_copies_positive_int():
     """
     negative, total_copies must be a positive integer (reject 0 and negatives).
@@ -95,3 +120,44 @@ def test_duplicate_isbn():
     assert ("already" in second_note.lower()) or ("exists" in second_note.lower())
 
 
+def on_new_thread(lookup):
+    """Run lookup on a fresh thread (so on a fresh connection) and return its result."""
+    result = []
+
+    def run():
+        try:
+            result.append(lookup())
+        finally:
+            database.close_db_connection()
+
+    worker = threading.Thread(target=run)
+    worker.start()
+    worker.join()
+    return result[0]
+
+
+def test_book_lookup_sees_other_connection_write(tmp_path, monkeypatch):
+    """
+    A write committed through another connection shows up in book lookups on every thread,
+    including one that only opens its connection afterwards (each Flask request thread has its own).
+    Uses a file DB, like the app does.
+    """
+    db_file = str(tmp_path / "library.db")
+    seed = sqlite3.connect(db_file)
+    seed.execute(
+        "CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT, author TEXT, isbn TEXT UNIQUE,"
+        " total_copies INTEGER, available_copies INTEGER)"
+    )
+    seed.execute("INSERT INTO books VALUES (1, 'Emma', 'Jane Austen', '9780141439587', 3, 3)")
+    seed.commit()
+    monkeypatch.setattr(database, "DATABASE", db_file)
+
+    assert on_new_thread(lambda: get_book_by_id(1)["available_copies"]) == 3
+    assert on_new_thread(lambda: get_book_by_isbn("9780141439587")["available_copies"]) == 3
+
+    seed.execute("UPDATE books SET available_copies = 0 WHERE id = 1")
+    seed.commit()
+    seed.close()
+
+    assert on_new_thread(lambda: get_book_by_id(1)["available_copies"]) == 0
+    assert on_new_thread(lambda: get_book_by_isbn("9780141439587")["available_copies"]) == 0
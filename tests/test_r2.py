@@ -1,9 +1,11 @@
-from database import get_all_books, insert_book
+import pytest
+from database import get_all_books, insert_book, bulk_insert_books, get_db_connection
 
 # R2 focus:
 # Table shows: id, title, author, isbn, available_copies, total_copies
 # Business rules: IDs are auto-generated positive ints and copies consistent and ISBN is 13 digits.
 
+@pytest.mark.fresh_db
 def test_empty():
     """
     With no books inserted, the catalog should come back empty.
@@ -55,3 +57,29 @@ def test_copies_ok():
         total = row["total_copies"]
         assert isinstance(avail, int) and isinstance(total, int)
         assert 0 <= avail <= total
+
+
+def test_bulk_insert_all_or_nothing():
+    """
+    A batch with a duplicate ISBN inside it is rejected as a whole, leaving the catalog empty.
+    """
+    ok = bulk_insert_books([
+        ("Dracula", "Bram Stoker", "9780141439846", 1, 1),
+        ("Dracula (again)", "Bram Stoker", "9780141439846", 1, 1),
+    ])
+    assert ok is False
+    assert get_all_books() == []
+
+
+@pytest.mark.no_transaction
+def test_bulk_insert_rolls_back_without_outer_transaction():
+    """
+    Same batch with no transaction already open, so the BEGIN IMMEDIATE / ROLLBACK path runs.
+    """
+    ok = bulk_insert_books([
+        ("Dracula", "Bram Stoker", "9780141439846", 1, 1),
+        ("Dracula (again)", "Bram Stoker", "9780141439846", 1, 1),
+    ])
+    assert ok is False
+    assert not get_db_connection().in_transaction
+    assert get_all_books() == []
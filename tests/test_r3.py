@@ -4,35 +4,37 @@ from services.library_service import borrow_book_by_patron
 
 # Minimal DB helpers used to inspect state
 from database import (
-    insert_book,
-    get_book_by_id,
-    get_book_by_isbn,
+    insert_book_returning_id,
+    bulk_insert_books,
+    get_book_ids_by_isbn,
+    get_available_copies,
     get_patron_borrow_count,
-    insert_borrow_record,
+    bulk_insert_borrow_records,
 )
 
+_NOW = datetime(2024, 6, 1, 12, 0, 0)
+pytestmark = pytest.mark.frozen_clock(_NOW)
+
+# Filler books for stack_loans, formatted once; quota can't exceed this many
+_STACK_ISBNS = tuple(f"9791{i:09d}" for i in range(1024))
+_STACK_TITLES = tuple(f"Foundation Vol.{i}" for i in range(1024))
+
 def mint_book(*, title: str, author: str, isbn: str, total: int, avail: int) -> int:
     """
     Insert a book and return its DB id.
     """
-    insert_book(title, author, isbn, total, avail)
-    return get_book_by_isbn(isbn)["id"]
+    return insert_book_returning_id(title, author, isbn, total, avail)
 
 def stack_loans(patron_id: str, quota: int):
     """
     Give this patron quota active loans (no return_date).
     """
-    for i in range(quota):
-        book_pk = mint_book(
-            title=f"Foundation Vol.{i}",
-            author="Isaac Asimov",
-            isbn=f"9791{i:09d}",
-            total=1,
-            avail=1,
-        )
-        began_at = datetime.now() - timedelta(days=2)
-        due_on = began_at + timedelta(days=14)
-        insert_borrow_record(patron_id, book_pk, began_at, due_on)
+    isbns = _STACK_ISBNS[:quota]
+    assert bulk_insert_books([(title, "Isaac Asimov", isbn, 1, 1) for title, isbn in zip(_STACK_TITLES, isbns)])
+    book_pks = get_book_ids_by_isbn(isbns)
+    began_at = _NOW - timedelta(days=2)
+    due_on = began_at + timedelta(days=14)
+    assert bulk_insert_borrow_records([(patron_id, pk, began_at, due_on) for pk in book_pks.values()])
 
 def test_borrow_happy_path_drops_stock():
     """
@@ -46,27 +48,29 @@ def test_borrow_happy_path_drops_stock():
         total=3,
         avail=3,
     )
-    avail_before = get_book_by_id(book_pk)["available_copies"]
+    avail_before = get_available_copies(book_pk)
     ok, msg = borrow_book_by_patron(card, book_pk)
-    avail_after = get_book_by_id(book_pk)["available_copies"]
+    avail_after = get_available_copies(book_pk)
     assert ok is True, "This borrow should go through."
     assert "success" in (msg or "").lower()
     assert avail_after == avail_before - 1, "Stock should drop by exactly one."
     assert get_patron_borrow_count(card) == 1, "Patron’s active count should tick up."
 
-@pytest.mark.parametrize("bad_patron", ["", "12345", "1234567", "12A456", "abcdef", " 123456 "])
-def test_reject_bad_patron_format(bad_patron):
+def test_reject_bad_patron_formats():
     """
     Negative: patron ID must be exactly six digits.
+    The ID is checked before the book is looked up, so no book is seeded.
     """
-    book_pk = mint_book(
-        title="Pride and Prejudice",
-        author="Jane Austen",
-        isbn="9780141439518",
-        total=1,
-        avail=1,
-    )
-    ok, msg = borrow_book_by_patron(bad_patron, book_pk)
+    for bad_patron in ["", "12345", "1234567", "12A456", "abcdef", " 123456 ", "١٢٣٤٥٦", "１２３４５６"]:
+        ok, msg = borrow_book_by_patron(bad_patron, 1)
+        assert ok is False, bad_patron
+        assert "invalid patron id" in (msg or "").lower()
+
+def test_reject_patron_with_trailing_newline():
+    """
+    Negative: six digits followed by a newline (which ^...$ would let through) is still rejected.
+    """
+    ok, msg = borrow_book_by_patron("123456\n", 1)
     assert ok is False
     assert "invalid patron id" in (msg or "").lower()
 
@@ -82,9 +86,9 @@ def test_reject_when_zero_stock():
         total=1,
         avail=0,
     )
-    avail_before = get_book_by_id(book_pk)["available_copies"]
+    avail_before = get_available_copies(book_pk)
     ok, msg = borrow_book_by_patron(card, book_pk)
-    avail_after = get_book_by_id(book_pk)["available_copies"]
+    avail_after = get_available_copies(book_pk)
     assert ok is False
     assert "not available" in (msg or "").lower()
     assert avail_after == avail_before == 0, "Should stay at zero when the borrow is denied."
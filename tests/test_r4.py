@@ -5,24 +5,25 @@ from services.library_service import return_book_by_patron
 
 # helpers for setup
 from database import (
-    get_book_by_isbn,
     insert_borrow_record,
-    insert_book,
-    get_book_by_id,
+    insert_book_returning_id,
+    get_available_copies,
     get_patron_borrow_count,
 )
 
+_NOW = datetime(2024, 6, 1, 12, 0, 0)
+pytestmark = pytest.mark.frozen_clock(_NOW)
+
 def shelve_book(*, title: str, author: str, isbn: str, total: int, avail: int) -> int:
     """Insert a book with distinctive data and return its DB id."""
-    insert_book(title, author, isbn, total, avail)
-    return get_book_by_isbn(isbn)["id"]
+    return insert_book_returning_id(title, author, isbn, total, avail)
 
 def seed_active_loan(patron_id: str, *, book_id: int, days_until_due: int = 7):
     """
     Created an active borrow (no return_date) for this patron+book. Uses days_until_due < 0 to make it overdue.
     """
-    start = datetime.now() - timedelta(days=14)
-    due = datetime.now() + timedelta(days=days_until_due)
+    start = _NOW - timedelta(days=14)
+    due = _NOW + timedelta(days=days_until_due)
     insert_borrow_record(patron_id, book_id, start, due)
 
 
@@ -42,19 +43,18 @@ def test_increments_stock_and_clears_active():
         avail=0,
     )
     seed_active_loan(patron, book_id=book, days_until_due=3)
-    before_avail = get_book_by_id(book)["available_copies"]
-    before_count = get_patron_borrow_count(patron)
+    before_avail = get_available_copies(book)
     ok, msg = return_book_by_patron(patron, book)
-    after_avail = get_book_by_id(book)["available_copies"]
-    after_count = get_patron_borrow_count(patron)
+    after_avail = get_available_copies(book)
     assert ok is True
     assert ("success" in (msg or "").lower()) or ("return complete" in (msg or "").lower())
     assert after_avail == before_avail + 1
-    assert after_count == max(0, before_count - 1)
+
+    # the seeded loan was the patron's only one
+    assert get_patron_borrow_count(patron) == 0
 
 
-@pytest.mark.parametrize("bad_patron", ["", "12345", "1234567", "12a456", " 222222 "])
-def test_patron_id(bad_patron):
+def test_patron_id():
     """
     Negative Patron ID must be exactly 6 digits (no spaces or letters).
     """
@@ -67,12 +67,11 @@ def test_patron_id(bad_patron):
     )
     # Someone has it out
     seed_active_loan("424242", book_id=book, days_until_due=5)
-    before_avail = get_book_by_id(book)["available_copies"]
-    ok, msg = return_book_by_patron(bad_patron, book)
-    after_avail = get_book_by_id(book)["available_copies"]
-    assert ok is False
-    assert "invalid patron id" in (msg or "").lower()
-    assert after_avail == before_avail == 0
+    for bad_patron in ["", "12345", "1234567", "12a456", " 222222 "]:
+        ok, msg = return_book_by_patron(bad_patron, book)
+        assert ok is False, bad_patron
+        assert "invalid patron id" in (msg or "").lower()
+    assert get_available_copies(book) == 0
 
 def test_rejects_not_borrower():
     """
@@ -89,9 +88,9 @@ def test_rejects_not_borrower():
         avail=0,
     )
     seed_active_loan(true_borrower, book_id=book, days_until_due=2)
-    before_avail = get_book_by_id(book)["available_copies"]
+    before_avail = get_available_copies(book)
     ok, msg = return_book_by_patron(imposter, book)
-    after_avail = get_book_by_id(book)["available_copies"]
+    after_avail = get_available_copies(book)
     assert ok is False
     assert ("not borrowed" in (msg or "").lower()) or ("no active" in (msg or "").lower())
     assert after_avail == before_avail == 0
@@ -110,9 +109,9 @@ def test_overdue_fee_updates_stock():
     )
     # loan overdue by 5 days
     seed_active_loan(patron, book_id=book, days_until_due=-5)
-    before_avail = get_book_by_id(book)["available_copies"]
+    before_avail = get_available_copies(book)
     ok, msg = return_book_by_patron(patron, book)
-    after_avail = get_book_by_id(book)["available_copies"]
+    after_avail = get_available_copies(book)
     assert ok is True
     assert after_avail == before_avail + 1
 
@@ -1,69 +1,84 @@
+import pytest
 from datetime import datetime, timedelta
 from services.library_service import calculate_late_fee_for_book
-from database import insert_book, insert_borrow_record, get_book_by_isbn
+from database import (
+    insert_book_returning_id,
+    insert_borrow_record,
+    bulk_insert_books,
+    bulk_insert_borrow_records,
+    get_book_ids_by_isbn,
+    get_patron_fee_summary,
+    get_patron_late_fee_total,
+)
+
+_NOW = datetime(2024, 6, 1, 12, 0, 0)
+pytestmark = pytest.mark.frozen_clock(_NOW)
 
 def shelve(title: str, author: str, isbn: str, total: int, avail: int) -> int:
     """Insert a unique book and return its DB id."""
-    insert_book(title, author, isbn, total, avail)
-    return get_book_by_isbn(isbn)["id"]
+    return insert_book_returning_id(title, author, isbn, total, avail)
 
 def borrow_with_due(patron: str, *, book_id: int, days_overdue: int) -> None:
     """
     Create active borrow so days_overdue is how many days past due we are. DB respects the spec
     via due = borrow + 14 days.
     """
-    now = datetime.now()
-    due = now - timedelta(days=days_overdue)
+    due = _NOW - timedelta(days=days_overdue)
 
     # due 14 days after borrow
     borrowed = due - timedelta(days=14)
     insert_borrow_record(patron, book_id, borrowed, due)
 
 
-def test_fee_none_when_before_due():
-    """
-    Positive not overdue means fee 0.00 and days_overdue is also 0
-    """
-    book = shelve("Tensors in Teacups", "N. Chai", "9650000001017", total=2, avail=2)
-    patron = "741963"
+# (title, author, isbn, days_overdue, expected fee) for each band of the fee policy
+_FEE_BANDS = (
+    ("Tensors in Teacups", "N. Chai",    "9650000001017", 0,  0.00),   # not overdue
+    ("Hashmaps & Honey",   "Q. Apiary",  "9650000002028", 3,  1.50),   # 3 * $0.50
+    ("Semaphore Sorbet",   "M. Channel", "9650000003039", 10, 6.50),   # 7 * $0.50 + 3 * $1.00
+    ("Overdue Odyssey",    "L. Late",    "9650000004040", 40, 15.00),  # capped at $15
+    ("Seven Sleepers",     "W. Week",    "9650000005051", 7,  3.50),   # last $0.50 day
+    ("Eighth Wonder",      "O. Cto",     "9650000006062", 8,  4.50),   # first $1.00 day
+    ("Almost Capped",      "E. Dge",     "9650000007073", 18, 14.50),  # 7 * $0.50 + 11 * $1.00
+    ("Cap Reached",        "N. Ineteen", "9650000008084", 19, 15.00),  # $15.50 before the cap
+)
 
-    # not overdo because marked as today
-    borrow_with_due(patron, book_id=book, days_overdue=0)
-    out = calculate_late_fee_for_book(patron, book)
-    assert isinstance(out, dict)
-    assert out.get("days_overdue") == 0
-    assert round(float(out.get("fee_amount", 0.0)), 2) == 0.00
 
-def test_fee_first_band_three_days():
+def test_fee_bands():
     """
-    Positive 3 days overdue is 3 * 0.50 = $1.50.
+    Positive every band of the fee policy: on time is 0.00, 3 days is $1.50,
+    10 days is $6.50 and 40 days hits the $15 cap, plus the edges where the rate
+    changes and where the cap starts. days_overdue is reported as-is.
+    All loans are seeded with one batch insert each for books and borrows.
     """
-    book = shelve("Hashmaps & Honey", "Q. Apiary", "9650000002028", total=1, avail=1)
-    patron = "258147"
-    borrow_with_due(patron, book_id=book, days_overdue=3)
-    out = calculate_late_fee_for_book(patron, book)
-    assert out.get("days_overdue") == 3
-    assert round(float(out.get("fee_amount", -1.0)), 2) == 1.50
+    patron = "741963"
+    assert bulk_insert_books([(title, author, isbn, 1, 1) for title, author, isbn, _, _ in _FEE_BANDS])
+    book_ids = get_book_ids_by_isbn([isbn for _, _, isbn, _, _ in _FEE_BANDS])
+    loans = []
+    for _, _, isbn, days, _ in _FEE_BANDS:
+        due = _NOW - timedelta(days=days)
+        loans.append((patron, book_ids[isbn], due - timedelta(days=14), due))
+    assert bulk_insert_borrow_records(loans)
 
-def test_fee_second_band_ten_days():
-    """
-    Positive 10 days overdue is 7*$0.50 + 3*$1.00 = $3.50 + $3.00 = $6.50.
-    """
-    book = shelve("Semaphore Sorbet", "M. Channel", "9650000003039", total=1, avail=1)
-    patron = "864209"
-    borrow_with_due(patron, book_id=book, days_overdue=10)
-    out = calculate_late_fee_for_book(patron, book)
-    assert out.get("days_overdue") == 10
-    assert round(float(out.get("fee_amount", -1.0)), 2) == 6.50
+    for title, _, isbn, days, expected in _FEE_BANDS:
+        out = calculate_late_fee_for_book(patron, book_ids[isbn])
+        assert isinstance(out, dict)
+        assert out.get("days_overdue") == days, title
+        assert round(float(out.get("fee_amount", -1.0)), 2) == expected, title
 
 
-def test_fee_capped_at_max():
+def test_sql_fee_summary_matches_calculator():
     """
-    Positive 40 days overdue would exceed the rate total $15 after cap.
+    Positive the SQL fee summary agrees with calculate_late_fee_for_book in every band,
+    and the total is 0 + 1.50 + 6.50 + 15.00.
     """
-    book = shelve("Overdue Odyssey", "L. Late", "9650000004040", total=1, avail=1)
-    patron = "505155"
-    borrow_with_due(patron, book_id=book, days_overdue=40)
-    out = calculate_late_fee_for_book(patron, book)
-    assert out.get("days_overdue") == 40
-    assert round(float(out.get("fee_amount", -1.0)), 2) == 15.00
+    patron = "369258"
+    for i, days in enumerate((0, 3, 10, 40)):
+        book = shelve(f"Band {days}", "T. Tier", f"96600000{i:05d}", total=1, avail=1)
+        borrow_with_due(patron, book_id=book, days_overdue=days)
+    rows = get_patron_fee_summary(patron, _NOW.date())
+    assert len(rows) == 4
+    for row in rows:
+        expected = calculate_late_fee_for_book(patron, row["book_id"])
+        assert row["days_late"] == expected["days_overdue"]
+        assert round(row["fee"], 2) == expected["fee_amount"]
+    assert round(get_patron_late_fee_total(patron, _NOW.date()), 2) == 23.00
@@ -1,29 +1,46 @@
+import pytest
 from services.library_service import search_books_in_catalog
-from database import insert_book, get_book_by_isbn
+from database import insert_book_returning_id, bulk_insert_books, get_db_connection
+
+# The searches here only read the catalog, so it is seeded once for the module
+pytestmark = pytest.mark.preserve_catalog
+
+# Columns every search result row must carry
+_REQUIRED_COLS = frozenset({"id", "title", "author", "isbn", "total_copies", "available_copies"})
+
 def plant_book(*, title: str, author: str, isbn: str, total: int, avail: int) -> int:
     """
     Insert a book and return its DB id.
     """
     assert len(isbn) == 13 and isbn.isdigit(), "ISBN must be 13 digits long"
-    insert_book(title, author, isbn, total, avail)
-    return get_book_by_isbn(isbn)["id"]
+    return insert_book_returning_id(title, author, isbn, total, avail)
 
 def seed_sample_stack():
     """
     Small shelf
     """
-    plant_book(title="Nights",          author="Ignus Starling",   isbn="9845123764029", total=3, avail=2)
-    plant_book(title="Ledger",          author="Eva Nova",         isbn="9728094157364", total=4, avail=4)
-    plant_book(title="Quantum Physics", author="Richard Orchard",  isbn="9901738456207", total=2, avail=1)
-    plant_book(title="Algorithms",      author="Mimi Moonfield",   isbn="9615402981735", total=5, avail=5)
+    assert bulk_insert_books([
+        ("Nights",          "Ignus Starling",   "9845123764029", 3, 2),
+        ("Ledger",          "Eva Nova",         "9728094157364", 4, 4),
+        ("Quantum Physics", "Richard Orchard",  "9901738456207", 2, 1),
+        ("Algorithms",      "Mimi Moonfield",   "9615402981735", 5, 5),
+    ])
+
+@pytest.fixture(scope="module")
+def sample_stack(db_schema):
+    """
+    The small shelf, shared by every test in this module.
+    """
+    seed_sample_stack()
+    yield
+    get_db_connection().execute("DELETE FROM books")
 
 
-def test_title_fuzzy_casefold_hits():
+def test_title_fuzzy_casefold_hits(sample_stack):
     """
     POSITIVE: Title search is partial + case-insensitive.
     Check two separate queries: 'nIgHt' -> 'Nights', 'LEDGER' -> 'Ledger'.
     """
-    seed_sample_stack()
 
     # lower/upper mix shouldnt matter
     rows_night = search_books_in_catalog("nIgHt", "title")
@@ -34,25 +51,24 @@ def test_title_fuzzy_casefold_hits():
     assert "Ledger" in titles_ledger
 
     # result rows look like catalog rows
-    required = {"id", "title", "author", "isbn", "total_copies", "available_copies"}
-    assert all(required.issubset(r.keys()) for r in rows_night + rows_ledger)
+    has_cols = _REQUIRED_COLS.issubset
+    assert all(has_cols(r.keys()) for r in rows_night)
+    assert all(has_cols(r.keys()) for r in rows_ledger)
 
-def test_author_fuzzy_hit():
+def test_author_fuzzy_hit(sample_stack):
     """
     positive Author search is partial + case-insensitive. 'mOOn' should match 'Mimi Moonfield'.
     """
-    seed_sample_stack()
     rows = search_books_in_catalog("mOOn", "author")
     authors = {r["author"] for r in rows}
     assert "Mimi Moonfield" in authors
 
 
-def test_isbn_exact_only():
+def test_isbn_exact_only(sample_stack):
     """
     positive ISBN must be an exact 13-digit match
     Expect one hit for 9901738456207 -> 'Quantum Physics'
     """
-    seed_sample_stack()
     rows = search_books_in_catalog("9901738456207", "isbn")
     assert len(rows) == 1
     book = rows[0]
@@ -60,15 +76,39 @@ def test_isbn_exact_only():
     assert book["isbn"] == "9901738456207"
 
 
-def test_isbn_partial_rejected():
+def test_isbn_partial_rejected(sample_stack):
     """
     Negative Partial ISBNs shouldnt match
     """
-    seed_sample_stack()
     # One digit short should not return anything
     rows = search_books_in_catalog("990173845620", "isbn")
     assert rows == [] or len(rows) == 0
 
+def test_title_wildcards_are_literal(sample_stack):
+    """
+    negative, SQL wildcard characters in the query are matched literally, not as patterns.
+    """
+    plant_book(title="100% Cotton", author="Ada Loom", isbn="9123456789012", total=1, avail=1)
+    assert search_books_in_catalog("%", "title")[0]["title"] == "100% Cotton"
+    assert len(search_books_in_catalog("%", "title")) == 1
+    assert search_books_in_catalog("N_ghts", "title") == []
+
+def test_search_folds_non_ascii_case(sample_stack):
+    """
+    positive, case-insensitive matching covers accented letters too, not just ASCII.
+    """
+    plant_book(title="Émile", author="Gabriel García Márquez", isbn="9234567890123", total=1, avail=1)
+    assert [r["title"] for r in search_books_in_catalog("émile", "title")] == ["Émile"]
+    assert [r["title"] for r in search_books_in_catalog("GARCÍA", "author")] == ["Émile"]
+
+def test_every_search_type_returns_dicts(sample_stack):
+    """
+    positive, title, author and ISBN searches all hand back plain dicts.
+    """
+    for term, kind in [("Nights", "title"), ("Moon", "author"), ("9901738456207", "isbn")]:
+        rows = search_books_in_catalog(term, kind)
+        assert rows and all(type(r) is dict for r in rows), kind
+
 def test_search_rejects_empty_query():
     results = search_books_in_catalog("", "title")
     assert results == []
@@ -1,29 +1,59 @@
+import re
+import pytest
 from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+from services import library_service
 from services.library_service import get_patron_status_report, return_book_by_patron
 from database import (
     insert_borrow_record,
-    insert_book,
-    update_book_availability,
-    get_book_by_isbn,
+    update_availability_bulk,
+    bulk_insert_books,
+    bulk_insert_borrow_records,
+    get_book_ids_by_isbn,
+    borrow_book_atomic,
+    get_db_connection,
+    get_patron_borrowed_books,
 )
 
+_NOW = datetime(2024, 6, 1, 12, 0, 0)
+
+# The catalog below is seeded once for the module; each test's loans and stock
+# changes are rolled back with its transaction, so no per-test wipe is needed
+pytestmark = [pytest.mark.preserve_catalog, pytest.mark.frozen_clock(_NOW)]
+
+# 13 digits and nothing else (\Z, unlike $, won't accept a trailing newline)
+_ISBN_RE = re.compile(r"\A[0-9]{13}\Z")
+
+# Keys every status report must carry
+_REQUIRED_KEYS = frozenset(("borrowed_now", "active_count", "late_fees", "history"))
+
+_CATALOG = [
+    dict(title="To Kill a Mockingbird", author="Harper Lee", isbn="9465128374009", total=2, avail=2),
+    dict(title="The Hobbit", author="J.R.R. Tolkien", isbn="9057318645201", total=2, avail=2),
+    dict(title="Pride and Prejudice", author="Jane Austen", isbn="8190476523814", total=2, avail=2),
+    dict(title="The Name of the Rose", author="Umberto Eco", isbn="9602847153097", total=1, avail=1),
+    dict(title="Dune", author="Frank Herbert", isbn="9780441172719", total=1, avail=1),
+    dict(title="Emma", author="Jane Austen", isbn="9780141439587", total=1, avail=1),
+]
+
 
 #helpers
-def stash(*, title: str, author: str, isbn: str, total: int, avail: int) -> int:
+def stash_many(books: List[Dict]) -> Dict[str, int]:
     """
-    Insert a book and return its id.
+    Insert several books (dicts with title, author, isbn, total, avail) in one batch; returns isbn -> id.
     """
-    assert len(isbn) == 13 and isbn.isdigit()
-    insert_book(title, author, isbn, total, avail)
-    return get_book_by_isbn(isbn)["id"]
+    isbns = [b["isbn"] for b in books]
+    assert all(map(_ISBN_RE.match, isbns))
+    assert bulk_insert_books([(b["title"], b["author"], b["isbn"], b["total"], b["avail"]) for b in books])
+    return get_book_ids_by_isbn(isbns)
 
 
 def checkout(patron: str, *, book_id: int, days_ago: int = 1, due_in: int = 7) -> None:
     """
     Create active loan (no return_date)
     """
-    start = datetime.now() - timedelta(days=days_ago)
-    due = datetime.now() + timedelta(days=due_in)
+    start = _NOW - timedelta(days=days_ago)
+    due = _NOW + timedelta(days=due_in)
     insert_borrow_record(patron, book_id, start, due)
 
 
@@ -31,39 +61,58 @@ def checkout_overdue(patron: str, *, book_id: int, overdue_days: int) -> None:
     """
     Create an active loan thats already overdue by n days.
     """
-    start = datetime.now() - timedelta(days=16)
-    due = datetime.now() - timedelta(days=overdue_days)
+    start = _NOW - timedelta(days=16)
+    due = _NOW - timedelta(days=overdue_days)
     insert_borrow_record(patron, book_id, start, due)
 
 
+def checkout_many(patron: str, loans: Iterable[Tuple[int, int, int]]) -> None:
+    """
+    Create several active loans in one batch; each is (book_id, days_ago, due_in).
+    A negative due_in makes that loan overdue by that many days.
+    """
+    assert bulk_insert_borrow_records([
+        (patron, book_id, _NOW - timedelta(days=days_ago), _NOW + timedelta(days=due_in))
+        for book_id, days_ago, due_in in loans
+    ])
+
+
+def loan(patron: str, *, book_id: int, days_ago: int = 1, due_in: int = 7) -> None:
+    """
+    Lend a copy: record the active loan and take it off the shelf in one transaction.
+    """
+    status = borrow_book_atomic(patron, book_id, _NOW - timedelta(days=days_ago), _NOW + timedelta(days=due_in))
+    assert status == "ok", status
+
+
+@pytest.fixture(scope="module")
+def catalog(db_schema):
+    """
+    Every book the R7 tests use, inserted once; isbn -> id.
+    """
+    ids = stash_many(_CATALOG)
+    yield ids
+    get_db_connection().executemany("DELETE FROM books WHERE id = ?", [(i,) for i in ids.values()])
+
+
 # tests
-def test_mixed_active_returned():
+def test_mixed_active_returned(catalog):
     """
     positive, one active (on time), one active (overdue), one returned
     """
     patron = "742981"
-    b1 = stash(title="To Kill a Mockingbird", author="Harper Lee",
-               isbn="9465128374009", total=2, avail=2)
-    b2 = stash(title="The Hobbit", author="J.R.R. Tolkien",
-               isbn="9057318645201", total=2, avail=2)
-    b3 = stash(title="Pride and Prejudice", author="Jane Austen",
-               isbn="8190476523814", total=2, avail=2)
-
-    # active but not overdue
-    checkout(patron, book_id=b1, days_ago=2, due_in=5)
-    update_book_availability(b1, -1)
-
-    # active but overdue by 4 days -> $2.00 fee at $0.50/day
-    checkout_overdue(patron, book_id=b2, overdue_days=4)
-    update_book_availability(b2, -1)
-
-    # returned
-    checkout(patron, book_id=b3, days_ago=10, due_in=2)
-    update_book_availability(b3, -1)
+    b1, b2, b3 = catalog["9465128374009"], catalog["9057318645201"], catalog["8190476523814"]
+
+    checkout_many(patron, [
+        (b1, 2, 5),    # active but not overdue
+        (b2, 16, -4),  # active but overdue by 4 days -> $2.00 fee at $0.50/day
+        (b3, 10, 2),   # returned below
+    ])
+    assert update_availability_bulk([(b1, -1), (b2, -1), (b3, -1)])
     return_book_by_patron(patron, b3)
     report = get_patron_status_report(patron)
     assert isinstance(report, dict)
-    assert {"borrowed_now", "active_count", "late_fees", "history"} <= report.keys()
+    assert _REQUIRED_KEYS <= report.keys()
 
     # counts line up
     assert report["active_count"] == len(report["borrowed_now"])
@@ -77,12 +126,17 @@ def test_mixed_active_returned():
     assert float(report["late_fees"]) >= 2.00
 
 
-def test_empty_patron():
+# (patron, expected status) for reports that should come back with nothing in them
+EMPTY_CASES = [
+    ("553207", "ok"),                 # positive, brand-new patron has no loans and no fees
+    ("12a456", "Invalid patron ID"),  # negative, bad patron id gets an empty report
+]
+
+
+def assert_zero_report(report: Dict) -> None:
     """
-    positive, brand-new patron is no loans and no fees.
+    No loans, no history and no fees.
     """
-    newcomer = "553207"
-    report = get_patron_status_report(newcomer)
     assert isinstance(report, dict)
     assert report.get("active_count", 0) == 0
     assert report.get("borrowed_now", []) == []
@@ -90,30 +144,114 @@ def test_empty_patron():
     assert report.get("history", []) == []
 
 
-def test_rejects_id():
+@pytest.mark.parametrize("patron,status", EMPTY_CASES)
+def test_empty_like(patron, status):
     """
-    negative, bad patron id should return an empty report.
+    Both a patron with no loans and a malformed id produce the zero report, told apart by status.
     """
-    bad = "12a456"
-    report = get_patron_status_report(bad)
-    assert isinstance(report, dict)
-    zero = (
-            report.get("active_count", 0) == 0
-            and float(report.get("late_fees", 0.0)) == 0.0
-            and report.get("borrowed_now", []) == []
-    )
-    assert zero or "status" in report
+    report = get_patron_status_report(patron)
+    assert_zero_report(report)
+    assert report["status"] == status
 
 
-def test_status_list_len():
+def test_malformed_id_skips_db(mocker):
+    """
+    negative, a structurally invalid id is answered without running any report query.
+    """
+    loans_stub = mocker.patch.object(library_service, "get_patron_loans")
+    fees_stub = mocker.patch.object(library_service, "get_patron_late_fee_cents")
+    for bad in ("12a456", "", "1234567"):
+        assert_zero_report(get_patron_status_report(bad))
+    loans_stub.assert_not_called()
+    fees_stub.assert_not_called()
+
+
+def test_status_list_len(catalog):
     """
     positive, active_count must equal len(borrowed_now)
     """
     who = "734268"
-    b = stash(title="The Name of the Rose", author="Umberto Eco",
-              isbn="9602847153097", total=1, avail=1)
-    checkout(who, book_id=b, days_ago=1, due_in=6)
-    update_book_availability(b, -1)
+    b = catalog["9602847153097"]
+    loan(who, book_id=b, days_ago=1, due_in=6)
     report = get_patron_status_report(who)
     assert report["active_count"] == len(report["borrowed_now"])
 
+
+def test_overdue_flags_and_dates(catalog):
+    """
+    positive, only the loan past its due date is flagged overdue and due dates come back as YYYY-MM-DD.
+    """
+    who = "615243"
+    late, fine = catalog["9780441172719"], catalog["9780141439587"]
+    checkout_overdue(who, book_id=late, overdue_days=2)
+    checkout(who, book_id=fine, days_ago=1, due_in=6)
+    report = get_patron_status_report(who)
+    flags = {row["title"]: row["overdue"] for row in report["borrowed_now"]}
+    assert flags == {"Dune": True, "Emma": False}
+    due = (_NOW - timedelta(days=2)).date().isoformat()
+    assert [row["due_date"] for row in report["borrowed_now"] if row["title"] == "Dune"] == [due]
+
+
+def test_due_today_is_not_overdue(catalog):
+    """
+    positive, boundary: loans due today, even earlier in the day than now, are neither flagged
+    nor charged; they only become overdue once the due day has passed.
+    """
+    who = "480516"
+    checkout(who, book_id=catalog["9465128374009"], days_ago=1, due_in=0)
+    insert_borrow_record(who, catalog["9057318645201"], _NOW - timedelta(days=14), _NOW.replace(hour=8))
+    report = get_patron_status_report(who)
+    assert report["active_count"] == 2
+    assert [row["overdue"] for row in report["borrowed_now"]] == [False, False]
+    assert float(report["late_fees"]) == 0.0
+
+
+def test_borrowed_books_overdue_against_given_now(catalog):
+    """
+    positive, get_patron_borrowed_books flags overdue loans against the now it is given,
+    not SQLite's wall clock.
+    """
+    who = "615204"
+    checkout(who, book_id=catalog["9465128374009"], days_ago=2, due_in=5)
+    checkout_overdue(who, book_id=catalog["9057318645201"], overdue_days=3)
+    flags = {row["book_id"]: row["is_overdue"] for row in get_patron_borrowed_books(who, _NOW)}
+    assert flags == {catalog["9465128374009"]: False, catalog["9057318645201"]: True}
+
+
+def test_report_queries_use_indexes(catalog):
+    """
+    positive, every query behind the report finds the patron's loans through an index
+    instead of scanning borrow_records.
+    """
+    who = "902741"
+    checkout_many(who, [(catalog["9780441172719"], 3, 4), (catalog["9780141439587"], 20, -6)])
+    conn = get_db_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        get_patron_status_report(who)
+    finally:
+        conn.set_trace_callback(None)
+
+    selects = [sql for sql in statements if sql.lstrip().upper().startswith("SELECT")]
+    assert selects
+    for sql in selects:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+        assert not any(step.startswith(("SCAN br", "SCAN borrow_records")) for step in plan), plan
+        assert any("USING INDEX idx_br_patron" in step for step in plan), plan
+
+
+def test_report_lists_every_active_loan():
+    """
+    positive, regression: nothing in the report pages or caps the loans; 15 active loans all come back.
+    """
+    who = "157015"
+    ids = stash_many([
+        dict(title=f"Serial Vol.{i}", author="P. Ager", isbn=f"97100000{i:05d}", total=1, avail=1)
+        for i in range(15)
+    ])
+    checkout_many(who, [(book_id, 2, 12) for book_id in ids.values()])
+    report = get_patron_status_report(who)
+    assert report["active_count"] == 15
+    assert len(report["history"]) == 15
+    assert {row["book_id"] for row in report["borrowed_now"]} == set(ids.values())